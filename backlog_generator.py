@@ -3,15 +3,26 @@ import requests
 import json
 import logging
 from dotenv import load_dotenv
+from config import TARGET_REPOS
+from github_client import GitHubError, get_client as get_github
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-TARGET_REPO = os.getenv("TARGET_REPO")
 
-def generate_backlog_item():
-    """Use OpenRouter to generate a new feature/fix based on repo context."""
+def default_repo():
+    return TARGET_REPOS[0] if TARGET_REPOS else None
+
+def generate_backlog_item(repo=None):
+    """Use OpenRouter to generate a new feature/fix based on repo context.
+
+    `repo` defaults to the first of TARGET_REPOS.
+    """
+    repo = repo or default_repo()
+    if not repo:
+        logger.error("TARGET_REPOS (or TARGET_REPO) not set.")
+        return None
     if not OPENROUTER_API_KEY:
         logger.error("OPENROUTER_API_KEY not set.")
         return None
@@ -20,7 +31,7 @@ def generate_backlog_item():
     # For now, we'll keep it simple and just ask for a generic improvement 
     # based on the repo name. In Phase 3 proper, we'd feed it more context.
     
-    prompt = f"Given the repository {TARGET_REPO}, suggest one meaningful new feature or improvement. Output only a JSON object with 'title' and 'body' fields."
+    prompt = f"Given the repository {repo}, suggest one meaningful new feature or improvement. Output only a JSON object with 'title' and 'body' fields."
     
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
@@ -49,20 +60,22 @@ def generate_backlog_item():
         logger.error(f"Failed to generate backlog item: {e}")
         return None
 
-def create_github_issue(item):
-    """Create a new issue in the target repository."""
+def create_github_issue(item, repo=None):
+    """Create a new issue in `repo`, by default the first of TARGET_REPOS."""
     if not item: return
+    repo = repo or default_repo()
+    if not repo:
+        logger.error("TARGET_REPOS (or TARGET_REPO) not set.")
+        return False
     
     title = item.get('title')
     body = item.get('body', '')
     label = os.getenv("ISSUE_LABEL", "jules-task")
     
-    cmd = f'gh issue create --repo {TARGET_REPO} --title "{title}" --body "{body}" --label "{label}"'
-    
     try:
-        result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
-        logger.info(f"Created new issue: {result.stdout.strip()}")
+        issue = get_github().create_issue(repo, title, body, labels=[label])
+        logger.info(f"Created new issue: {issue['url']}")
         return True
-    except Exception as e:
+    except GitHubError as e:
         logger.error(f"Failed to create GitHub issue: {e}")
         return False
@@ -1,12 +1,17 @@
 import os
+import sys
 import json
 import logging
-import subprocess
-import tempfile
 import argparse
 import random
 from dotenv import load_dotenv
+from config import TARGET_REPOS
 from openai import OpenAI
+from github_client import GitHubError, get_client as get_github
+import repo_cache
+import repo_index
+import dedup_index
+import db
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -16,11 +21,11 @@ load_dotenv()
 if os.getenv("GITHUB_TOKEN") and not os.getenv("GH_TOKEN"):
     os.environ["GH_TOKEN"] = os.getenv("GITHUB_TOKEN")
 
-TARGET_REPO = os.getenv("TARGET_REPO")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 ISSUE_LABEL = os.getenv("ISSUE_LABEL", "jules-task")
 MIN_BACKLOG_SIZE = 5
 MODEL = "anthropic/claude-3.5-haiku"
+MANIFEST_FILES = ["package.json", "requirements.txt", "Cargo.toml"]
 
 def get_client():
     return OpenAI(
@@ -28,45 +33,56 @@ def get_client():
         api_key=OPENROUTER_API_KEY,
     )
 
-def run_command(command, cwd=None):
+def get_repo_context(repo):
+    """Extract meaningful context from the repo's cached mirror.
+
+    The mirror is fetched incrementally, and the repository index and
+    context are cached per HEAD commit, so an unchanged repo costs one
+    `git ls-remote`. `files` is the index summary, bounded by
+    REPO_SUMMARY_BUDGET.
+    """
+    try:
+        path, sha, index = repo_index.get_index(repo)
+    except repo_cache.GitError as e:
+        logger.error(f"Failed to update mirror of {repo}: {e}")
+        return {}
+    context = repo_cache.cached(path, sha, "context", lambda: extract_context(path, sha))
+    return dict(context, files=repo_index.summarize(index))
+
+def extract_context(path, sha):
+    """Read the README and first manifest straight from git objects."""
+    logger.info(f"Extracting context at {sha[:12]}...")
+    tree = {name for name, _, _ in repo_cache.list_tree(path, sha)}
+    context = {}
+
+    readme = repo_cache.read_file(path, sha, "README.md", limit=3000)
+    if readme is not None:
+        context['readme'] = readme
+
+    for tech_file in MANIFEST_FILES:
+        if tech_file in tree:
+            context['tech_stack'] = repo_cache.read_file(path, sha, tech_file, limit=3000)
+            break
+
+    return context
+
+def get_existing_issues(repo, persona):
+    """Sync the duplicate index and return the existing titles closest to the persona's focus.
+
+    Without the database there is nothing to compare against, so none are returned.
+    """
     try:
-        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True, cwd=cwd)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Command failed: {command}\nError Output: {e.stderr}")
-        return None
+        dedup_index.sync(repo)
+    except GitHubError as e:
+        logger.error(f"Failed to sync issue index for {repo}: {e}")
     except Exception as e:
-        logger.error(f"Command failed: {command}\nError: {e}")
-        return None
-
-def get_repo_context():
-    """Clone repo and extract meaningful context."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        logger.info(f"Cloning {TARGET_REPO} for context...")
-        run_command(f"gh repo clone {TARGET_REPO} .", cwd=tmpdir)
-        
-        context = {}
-        context['files'] = run_command("find . -maxdepth 2 -not -path '*/.*'", cwd=tmpdir)
-        
-        if os.path.exists(os.path.join(tmpdir, "README.md")):
-            with open(os.path.join(tmpdir, "README.md"), 'r') as f:
-                context['readme'] = f.read()[:3000]
-                
-        for tech_file in ["package.json", "requirements.txt", "Cargo.toml"]:
-            path = os.path.join(tmpdir, tech_file)
-            if os.path.exists(path):
-                with open(path, 'r') as f:
-                    context['tech_stack'] = f.read()
-                break
-                
-        return context
-
-def get_existing_issues():
-    """Fetch all issues to avoid duplicates."""
-    output = run_command(f'gh issue list --repo {TARGET_REPO} --state all --limit 100 --json title')
-    if not output:
+        logger.error(f"Issue index unavailable for {repo}: {e}")
+        return []
+    try:
+        return dedup_index.nearest(repo, persona.get("prompt", ""))
+    except Exception as e:
+        logger.error(f"Failed to look up similar issues for {repo}: {e}")
         return []
-    return [issue['title'] for issue in json.loads(output)]
 
 def load_personas():
     """Load personas from JSON file or return default."""
@@ -83,7 +99,7 @@ def load_personas():
             }
         }
 
-def generate_new_ideas(context, existing_titles, persona):
+def generate_new_ideas(repo, context, existing_titles, persona):
     """Use OpenRouter via OpenAI SDK to generate ideas."""
     if not OPENROUTER_API_KEY:
         logger.error("OPENROUTER_API_KEY not set in environment.")
@@ -100,14 +116,14 @@ def generate_new_ideas(context, existing_titles, persona):
     prompt = f"""
 {system_prompt}
 
-TARGET REPO: {TARGET_REPO}
+TARGET REPO: {repo}
 
 ### Context:
 Files: {context.get('files', 'Unknown')}
 README: {context.get('readme', 'No README found.')}
 Tech Stack: {context.get('tech_stack', 'Unknown')}
 
-### Existing Issues (DO NOT DUPLICATE):
+### Most Similar Existing Issues (DO NOT DUPLICATE):
 {", ".join(existing_titles)}
 
 ### Instructions:
@@ -133,26 +149,50 @@ Tech Stack: {context.get('tech_stack', 'Unknown')}
         logger.error(f"OpenRouter Generation failed: {e}")
         return []
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--force", action="store_true", help="Ignore backlog size check")
-    parser.add_argument("--persona", type=str, help="Specific persona key to run")
-    args = parser.parse_args()
+def create_issues(repo, ideas, persona_name):
+    """Create the ideas as issues in bulk and index them locally.
+
+    Returns (created issues, [(title, error)] for the ones that failed).
+    """
+    items = [{"title": f"[{persona_name}] {idea['title']}", "body": idea.get('body', '')} for idea in ideas]
+    logger.info(f"Creating {len(items)} issue(s) ({persona_name}) in {repo}...")
+    # Only use the base ISSUE_LABEL to avoid errors with missing custom labels
+    results = get_github().create_issues(repo, items, labels=[ISSUE_LABEL])
+
+    created, failed = [], []
+    for item, result in zip(items, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to create issue '{item['title']}': {result}")
+            failed.append((item['title'], str(result)))
+        else:
+            logger.info(f"Created {repo}#{result['number']}: {item['title']}")
+            created.append(result)
+    try:
+        dedup_index.add(repo, created)
+    except Exception as e:
+        # The next sync indexes them anyway
+        logger.error(f"Failed to index {len(created)} new issue(s) for {repo}: {e}")
+    return created, failed
 
-    if not TARGET_REPO:
-        logger.error("TARGET_REPO not set.")
-        return
+def sustain_repo(repo, force=False, persona_key=None):
+    """Top up the backlog of a single repo.
 
-    current_backlog_json = run_command(f'gh issue list --repo {TARGET_REPO} --label "{ISSUE_LABEL}" --json number')
-    count = len(json.loads(current_backlog_json)) if current_backlog_json else 0
+    Returns (created issues, failures) as from create_issues; both are empty
+    when nothing was generated.
+    """
+    try:
+        count = len(get_github().list_issues(repo, labels=ISSUE_LABEL))
+    except GitHubError as e:
+        logger.error(f"Failed to count backlog for {repo}: {e}")
+        return [], []
     
-    logger.info(f"Current backlog count: {count}")
+    logger.info(f"Current backlog count for {repo}: {count}")
     
-    if count == 0 or args.force:
+    if count == 0 or force:
         logger.info("Backlog low or force enabled. Generating new ideas...")
         
         personas = load_personas()
-        selected_persona_key = args.persona
+        selected_persona_key = persona_key
         
         if not selected_persona_key:
             selected_persona_key = random.choice(list(personas.keys()))
@@ -164,21 +204,52 @@ def main():
         persona_config = personas[selected_persona_key]
         logger.info(f"Active Persona: {persona_config['name']}")
         
-        context = get_repo_context()
-        existing = get_existing_issues()
-        new_ideas = generate_new_ideas(context, existing, persona_config)
+        context = get_repo_context(repo)
+        existing = get_existing_issues(repo, persona_config)
+        ideas = generate_new_ideas(repo, context, existing, persona_config)
+        try:
+            new_ideas, _ = dedup_index.filter_ideas(repo, ideas)
+        except Exception as e:
+            logger.error(f"Duplicate check failed for {repo}; keeping all {len(ideas)} ideas: {e}")
+            new_ideas = ideas
         
         persona_name = persona_config.get("name", "Unknown")
-        
-        for idea in new_ideas:
-            title = idea['title']
-            prefixed_title = f"[{persona_name}] {title}"
-            body = idea['body']
-            logger.info(f"Creating issue ({persona_name}): {prefixed_title}")
-            # Only use the base ISSUE_LABEL to avoid errors with missing custom labels
-            run_command(f'gh issue create --repo {TARGET_REPO} --title "{prefixed_title}" --body "{body}" --label "{ISSUE_LABEL}"')
+        return create_issues(repo, new_ideas, persona_name)
     else:
-        logger.info(f"Backlog still has {count} items. Skipping generation.")
+        logger.info(f"Backlog for {repo} still has {count} items. Skipping generation.")
+        return [], []
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--force", action="store_true", help="Ignore backlog size check")
+    parser.add_argument("--persona", type=str, help="Specific persona key to run")
+    parser.add_argument("--repo", type=str, help="Only sustain this owner/repo (default: all configured repos)")
+    args = parser.parse_args()
+
+    repos = [args.repo] if args.repo else TARGET_REPOS
+    if not repos:
+        logger.error("TARGET_REPOS (or TARGET_REPO) not set.")
+        return
+
+    try:
+        db.init_db()
+    except Exception as e:
+        # Only duplicate detection needs the database; issues can still be created
+        logger.error(f"Database unavailable, skipping duplicate checks: {e}")
+
+    failures = 0
+    for repo in repos:
+        created, failed = sustain_repo(repo, force=args.force, persona_key=args.persona)
+        if created or failed:
+            numbers = ", ".join(f"#{issue['number']}" for issue in created) or "none"
+            print(f"{repo}: created {numbers}; {len(failed)} failed")
+            for title, error in failed:
+                print(f"  FAILED {title}: {error}")
+        failures += len(failed)
+
+    # A non-zero exit lets callers (e.g. the bot) report partial failures
+    if failures:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
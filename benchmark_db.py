@@ -0,0 +1,44 @@
+import argparse
+import statistics
+import time
+from dotenv import load_dotenv
+import db
+
+load_dotenv()
+
+def legacy_get_setting(key):
+    """The pre-pool access pattern: a fresh connection for every call."""
+    conn = db.get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT value FROM settings WHERE key = %s", (key,))
+            row = cur.fetchone()
+            return row[0] if row else None
+    finally:
+        conn.close()
+
+def measure(func, iterations):
+    """Return per-call latencies in milliseconds."""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func('paused')
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<22} mean={statistics.mean(samples):7.2f}ms  p50={statistics.median(samples):7.2f}ms  p95={p95:7.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-call latency of fresh vs pooled DB connections.")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    db.init_db()
+    report("fresh connection", measure(legacy_get_setting, args.iterations))
+    report("pooled connection", measure(db.get_setting, args.iterations))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import os
+import time
+import asyncio
+import logging
+from dotenv import load_dotenv
+import db
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Seconds the bot reuses a read before going back to the database
+BOT_CACHE_TTL = float(os.getenv("BOT_CACHE_TTL", "10"))
+
+_cache = {}  # key -> (expires_at, value)
+_locks = {}
+
+async def _cached(key, func, *args):
+    """Return func(*args) run on the db executor, reusing the result for BOT_CACHE_TTL.
+
+    Concurrent misses for the same key share one query.
+    """
+    entry = _cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    lock = _locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        value = await db.run_async(func, *args)
+        _cache[key] = (time.monotonic() + BOT_CACHE_TTL, value)
+        return value
+
+def invalidate(*keys):
+    """Drop cached reads so the next call queries again; everything if no keys are given."""
+    if not keys:
+        _cache.clear()
+    for key in keys:
+        _cache.pop(key, None)
+
+def start():
+    """Mirror the settings table into this process so pause changes made elsewhere show up at once."""
+    db.start_settings_listener(on_change=lambda key, value: invalidate(key))
+
+async def is_paused():
+    return await _cached("paused", db.is_paused)
+
+async def set_paused(paused):
+    await db.run_async(db.set_paused, paused)
+    _cache["paused"] = (time.monotonic() + BOT_CACHE_TTL, paused)
+
+async def recent_sessions(limit=5):
+    """(title, state) of the latest sessions."""
+    return await _cached(("recent_sessions", limit), db.get_recent_sessions, limit)
@@ -0,0 +1,8 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Comma-separated owner/repo list; a single TARGET_REPO is still accepted.
+# The first entry is the default for commands that don't name a repo.
+TARGET_REPOS = [r.strip() for r in (os.getenv("TARGET_REPOS") or os.getenv("TARGET_REPO") or "").split(",") if r.strip()]
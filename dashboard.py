@@ -1,65 +1,91 @@
+import os
 import streamlit as st
 import pandas as pd
 import db
-from datetime import datetime
-import time
 
 st.set_page_config(page_title="Octo-Jules Dashboard", layout="wide")
 
 st.title("Octo-Jules Automation Dashboard")
 st.write("Monitoring the Jules autonomous development loop.")
 
-def get_data():
-    conn = db.get_connection()
-    try:
-        query = "SELECT * FROM sessions ORDER BY created_at DESC"
-        df = pd.read_sql_query(query, conn)
-    finally:
-        conn.close()
-    return df
+# Query results are shared by every open tab for this long
+CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "30"))
+PAGE_SIZE = int(os.getenv("DASHBOARD_PAGE_SIZE", "50"))
+SESSION_COLUMNS = ["id", "issue_number", "issue_title", "repo", "state", "pr_number", "pr_url", "created_at", "updated_at"]
+
+@st.cache_data(ttl=CACHE_TTL)
+def get_state_counts():
+    return dict(db.get_state_counts())
+
+@st.cache_data(ttl=CACHE_TTL)
+def get_sessions_page(before=None):
+    return pd.DataFrame(db.get_sessions_page(PAGE_SIZE, before), columns=SESSION_COLUMNS)
+
+@st.cache_data(ttl=CACHE_TTL)
+def get_stage_latencies(days=30):
+    return pd.DataFrame(db.get_stage_latencies(days), columns=["state", "samples", "p50", "p95"])
+
+@st.cache_data(ttl=CACHE_TTL)
+def get_throughput(period="day", days=90):
+    columns = ["period", "started", "merged", "failed", "lead_time"]
+    return pd.DataFrame(db.get_throughput_rollup(days, period), columns=columns).set_index("period")
 
 # Sidebar for controls
 st.sidebar.header("Controls")
 if st.sidebar.button("Refresh Data"):
+    st.cache_data.clear()
     st.rerun()
 
-auto_refresh = st.sidebar.checkbox("Auto-refresh (30s)", value=True)
+auto_refresh = st.sidebar.checkbox(f"Auto-refresh ({CACHE_TTL}s)", value=True)
+period = st.sidebar.radio("Throughput by", ["day", "week"], horizontal=True)
+
+# Keyset pagination: a stack of (created_at, id) cursors, one per page shown so far
+if "page_cursors" not in st.session_state:
+    st.session_state.page_cursors = [None]
 
-# Main Dashboard
-data = get_data()
+# Only this part reruns on the timer, so refreshing never blocks a script thread
+@st.fragment(run_every=CACHE_TTL if auto_refresh else None)
+def overview():
+    counts = get_state_counts()
+    if not counts:
+        st.info("No sessions recorded in the database yet. Start the orchestrator to see data!")
+        return
 
-if data.empty:
-    st.info("No sessions recorded in the database yet. Start the orchestrator to see data!")
-else:
     # Summary Metrics
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Total Sessions", len(data))
-    col2.metric("Merged PRs", len(data[data['state'] == 'MERGED']))
-    col3.metric("In Progress", len(data[data['state'] == 'IN_PROGRESS']))
-    col4.metric("Failed", len(data[data['state'] == 'FAILED']))
+    col1.metric("Total Sessions", sum(counts.values()))
+    col2.metric("Merged PRs", counts.get('MERGED', 0))
+    col3.metric("In Progress", counts.get('IN_PROGRESS', 0))
+    col4.metric("Failed", counts.get('FAILED', 0))
 
     # Status breakdown chart
     st.subheader("Status Overview")
-    status_counts = data['state'].value_counts()
-    st.bar_chart(status_counts)
+    st.bar_chart(pd.Series(counts, name="count"))
 
-    # Detailed Table
+    # History comes from the session_daily_stats rollup, never from sessions itself
+    st.subheader(f"Throughput per {period} (last 90 days)")
+    throughput = get_throughput(period)
+    chart_col, lead_col = st.columns(2)
+    chart_col.line_chart(throughput[["started", "merged", "failed"]])
+    lead_col.caption("Mean lead time to merge (hours)")
+    lead_col.bar_chart((throughput["lead_time"].astype(float) / 3600).dropna())
+
+    # Pipeline analytics from the session_events log
+    st.subheader("Time in State (last 30 days)")
+    latencies = get_stage_latencies(30)
+    if latencies.empty:
+        st.info("No state transitions recorded yet.")
+    else:
+        latency_df = latencies.set_index("state")
+        st.bar_chart((latency_df[["p50", "p95"]] / 60).rename(columns=lambda c: f"{c} (min)"))
+
+def sessions_table():
     st.subheader("Recent Sessions")
-    
-    # Format the dataframe for display
-    display_df = data.copy()
-    
-    # Make PR URL clickable if it exists
-    def make_clickable(url):
-        if url:
-            return f'<a href="{url}" target="_blank">View PR</a>'
-        return ""
-
-    # Note: Streamlit's st.dataframe doesn't render HTML by default for security, 
-    # but we can use st.column_config.LinkColumn in newer versions or just show the table.
-    
+    cursors = st.session_state.page_cursors
+    page = get_sessions_page(cursors[-1])
+
     st.dataframe(
-        display_df,
+        page,
         column_config={
             "id": "Session ID",
             "issue_number": "Issue #",
@@ -75,7 +101,15 @@ else:
         use_container_width=True
     )
 
-# Auto-refresh logic
-if auto_refresh:
-    time.sleep(30)
-    st.rerun()
+    prev_col, label_col, next_col = st.columns([1, 2, 1])
+    if prev_col.button("← Newer", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    label_col.caption(f"Page {len(cursors)}")
+    if next_col.button("Older →", disabled=len(page) < PAGE_SIZE):
+        last = page.iloc[-1]
+        cursors.append((last["created_at"].to_pydatetime(), last["id"]))
+        st.rerun()
+
+overview()
+sessions_table()
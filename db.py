@@ -1,13 +1,32 @@
 import os
+import json
+import select
 import psycopg2
+import psycopg2.pool
+import psycopg2.extras
 import time
+import asyncio
+import atexit
+import functools
+import inspect
 import logging
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
+import metrics
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Idle connections older than this are pinged before being handed out again
+DB_POOL_HEALTHCHECK_AFTER = float(os.getenv("DB_POOL_HEALTHCHECK_AFTER", "30"))
+# Session state transitions are buffered and inserted in batches of this size
+SESSION_EVENT_BATCH = int(os.getenv("SESSION_EVENT_BATCH", "20"))
+
 def get_connection(retries=5, delay=2):
     """Establish a connection to the database with retry logic."""
     host = os.getenv("DB_HOST", "localhost")
@@ -37,123 +56,412 @@ def get_connection(retries=5, delay=2):
                 logger.error("Failed to connect to database after multiple attempts.")
                 raise e
 
-def init_db():
-    """Initialize the database schema."""
-    conn = get_connection()
+class ConnectionPool:
+    """Thread-safe, bounded pool of database connections.
+
+    Connections are opened lazily through get_connection(), so the pool keeps
+    its retry behaviour. At most `maxconn` connections are checked out at once;
+    further callers block until one is returned or `timeout` expires.
+    """
+
+    def __init__(self, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT, healthcheck_after=DB_POOL_HEALTHCHECK_AFTER):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+        self._idle = []  # (conn, returned_at) pairs, most recently returned last
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self):
+        """Check out a healthy connection, opening a new one if none are idle."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError(f"No database connection available within {self.timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return get_connection()
+                conn, returned_at = item
+                if self._is_healthy(conn, returned_at):
+                    return conn
+                logger.info("Discarding stale pooled database connection.")
+                self._close(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, closing it if it is broken or `discard` is set."""
+        try:
+            if discard or conn.closed:
+                self._close(conn)
+                return
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        except psycopg2.Error:
+            self._close(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.healthcheck_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+_pool = None
+_pool_lock = threading.Lock()
+_executor = None
+_settings_listener = None
+_session_events = []
+_session_events_lock = threading.Lock()
+
+SETTINGS_CHANNEL = "settings_changed"
+# Advisory lock key serialising init_db across processes
+INIT_LOCK_ID = 0x6f63746f
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+                atexit.register(_pool.closeall)
+    return _pool
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection; commits on success and rolls back on error."""
+    pool = get_pool()
+    conn = pool.getconn()
+    discard = False
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS sessions (
-                    id TEXT PRIMARY KEY,
-                    issue_number INTEGER,
-                    issue_title TEXT,
-                    repo TEXT,
-                    state TEXT,
-                    pr_number INTEGER,
-                    pr_url TEXT,
-                    created_at TIMESTAMP,
-                    updated_at TIMESTAMP
-                )
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
-            """)
-            # Create indexes for performance
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_repo_state ON sessions (repo, state)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_issue_repo ON sessions (issue_number, repo)")
-            
-            # Initialize default settings (paused=true for safety per user request)
-            cur.execute("INSERT INTO settings (key, value) VALUES ('paused', 'true') ON CONFLICT (key) DO NOTHING")
+        yield conn
         conn.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # The connection itself is suspect; don't hand it to the next caller
+        discard = True
+        raise
+    except Exception:
+        conn.rollback()
+        raise
     finally:
-        conn.close()
+        pool.putconn(conn, discard=discard)
+
+async def run_async(func, *args, **kwargs):
+    """Run a blocking db helper on a bounded executor without stalling the event loop.
+
+    The executor is sized to the pool, so threads never queue on a connection.
+    """
+    global _executor
+    if _executor is None:
+        with _pool_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def init_db():
+    """Initialize the database schema."""
+    with connection() as conn, conn.cursor() as cur:
+        # Replicas booting together would otherwise race on CREATE OR REPLACE
+        # ("tuple concurrently updated"); the lock is held until this transaction commits
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (INIT_LOCK_ID,))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                issue_number INTEGER,
+                issue_title TEXT,
+                repo TEXT,
+                state TEXT,
+                pr_number INTEGER,
+                pr_url TEXT,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS http_cache (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body TEXT,
+                next_url TEXT,
+                updated_at TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS pull_requests (
+                repo TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                session_id TEXT REFERENCES sessions(id) ON DELETE SET NULL,
+                issue_number INTEGER,
+                title TEXT,
+                head_ref TEXT,
+                url TEXT,
+                state TEXT,
+                updated_at TIMESTAMP,
+                PRIMARY KEY (repo, number)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS jules_sessions (
+                id TEXT PRIMARY KEY,
+                source TEXT,
+                title TEXT,
+                issue_number INTEGER,
+                state TEXT,
+                create_time TEXT
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS session_events (
+                id BIGSERIAL PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                repo TEXT,
+                from_state TEXT,
+                to_state TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS notification_outbox (
+                id BIGSERIAL PRIMARY KEY,
+                chat_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL,
+                last_error TEXT,
+                sent_at TIMESTAMP
+            )
+        """)
+        # Issues and sessions waiting for, or leased to, an orchestrator worker.
+        # A row with leased_until NULL or in the past is free to take.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS work_queue (
+                repo TEXT NOT NULL,
+                issue_number INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                body TEXT,
+                session_id TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                worker_id TEXT,
+                leased_until TIMESTAMP,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                enqueued_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (repo, issue_number)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS issue_index (
+                repo TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                signature BIGINT[] NOT NULL,
+                bands BIGINT[] NOT NULL,
+                updated_at TIMESTAMP,
+                PRIMARY KEY (repo, number)
+            )
+        """)
+        # Per-day, per-repo counters kept current by a trigger on sessions, so
+        # history charts read a few rows per day instead of scanning sessions
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS session_daily_stats (
+                day DATE NOT NULL,
+                repo TEXT NOT NULL DEFAULT '',
+                started INTEGER NOT NULL DEFAULT 0,
+                merged INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                lead_time_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, repo)
+            )
+        """)
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION rollup_session_stats() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO session_daily_stats (day, repo, started)
+                    VALUES (NEW.created_at::date, COALESCE(NEW.repo, ''), 1)
+                    ON CONFLICT (day, repo) DO UPDATE SET started = session_daily_stats.started + 1;
+                END IF;
+                -- Count each session once, on the day it reaches MERGED or FAILED
+                IF NEW.state IN ('MERGED', 'FAILED')
+                        AND (TG_OP = 'INSERT' OR OLD.state IS DISTINCT FROM NEW.state) THEN
+                    INSERT INTO session_daily_stats (day, repo, merged, failed, lead_time_seconds)
+                    VALUES (
+                        NEW.updated_at::date, COALESCE(NEW.repo, ''),
+                        (NEW.state = 'MERGED')::int, (NEW.state = 'FAILED')::int,
+                        CASE WHEN NEW.state = 'MERGED' THEN EXTRACT(EPOCH FROM NEW.updated_at - NEW.created_at) ELSE 0 END
+                    )
+                    ON CONFLICT (day, repo) DO UPDATE SET
+                        merged = session_daily_stats.merged + EXCLUDED.merged,
+                        failed = session_daily_stats.failed + EXCLUDED.failed,
+                        lead_time_seconds = session_daily_stats.lead_time_seconds + EXCLUDED.lead_time_seconds;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cur.execute("""
+            CREATE OR REPLACE TRIGGER sessions_rollup
+            AFTER INSERT OR UPDATE OF state ON sessions
+            FOR EACH ROW EXECUTE FUNCTION rollup_session_stats()
+        """)
+        # Backfill once from existing sessions; the trigger's lock keeps
+        # concurrent writers out until this transaction commits
+        cur.execute("""
+            INSERT INTO session_daily_stats (day, repo, started, merged, failed, lead_time_seconds)
+            SELECT day, repo, SUM(started), SUM(merged), SUM(failed), SUM(lead_time_seconds)
+            FROM (
+                SELECT created_at::date AS day, COALESCE(repo, '') AS repo,
+                       1 AS started, 0 AS merged, 0 AS failed, 0 AS lead_time_seconds
+                FROM sessions
+                UNION ALL
+                SELECT updated_at::date, COALESCE(repo, ''), 0,
+                       (state = 'MERGED')::int, (state = 'FAILED')::int,
+                       CASE WHEN state = 'MERGED' THEN EXTRACT(EPOCH FROM updated_at - created_at) ELSE 0 END
+                FROM sessions WHERE state IN ('MERGED', 'FAILED')
+            ) history
+            WHERE NOT EXISTS (SELECT 1 FROM session_daily_stats)
+            GROUP BY day, repo
+        """)
+        # Columns added after the table was first released
+        cur.execute("ALTER TABLE pull_requests ADD COLUMN IF NOT EXISTS mergeable TEXT")
+        cur.execute("ALTER TABLE pull_requests ADD COLUMN IF NOT EXISTS checks_state TEXT")
+        # Create indexes for performance
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_repo_state ON sessions (repo, state)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_issue_repo ON sessions (issue_number, repo)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions (created_at, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pull_requests_session ON pull_requests (session_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pull_requests_issue ON pull_requests (repo, issue_number)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jules_sessions_title ON jules_sessions (source, title)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jules_sessions_issue ON jules_sessions (source, issue_number)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_session_events_session ON session_events (session_id, created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_session_events_created ON session_events (created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_issue_index_bands ON issue_index USING GIN (bands)")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+            ON notification_outbox (next_attempt_at) WHERE sent_at IS NULL
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_work_queue_order ON work_queue (priority DESC, enqueued_at)")
+        
+        # Initialize default settings (paused=true for safety per user request)
+        cur.execute("INSERT INTO settings (key, value) VALUES ('paused', 'true') ON CONFLICT (key) DO NOTHING")
 
 def save_session(session_id, issue_number, title, repo, state="CREATED"):
     """Create or update a session record."""
     now = datetime.now()
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO sessions (id, issue_number, issue_title, repo, state, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT(id) DO UPDATE SET
-                    state=EXCLUDED.state,
-                    updated_at=EXCLUDED.updated_at
-            """, (session_id, issue_number, title, repo, state, now, now))
-        conn.commit()
-    finally:
-        conn.close()
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT state FROM sessions WHERE id = %s FOR UPDATE", (session_id,))
+        previous = cur.fetchone()
+        cur.execute("""
+            INSERT INTO sessions (id, issue_number, issue_title, repo, state, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT(id) DO UPDATE SET
+                state=EXCLUDED.state,
+                updated_at=EXCLUDED.updated_at
+        """, (session_id, issue_number, title, repo, state, now, now))
+    if previous is None or previous[0] != state:
+        record_session_event(session_id, repo, previous[0] if previous else None, state, now)
+
+def get_session(session_id):
+    """Retrieve a session by id."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT * FROM sessions WHERE id = %s", (session_id,))
+        return cur.fetchone()
 
 def update_session_pr(session_id, pr_number, pr_url):
-    """Update PR details for a session."""
+    """Update PR details for a session; a no-op (returning False) if it already points at that PR."""
     now = datetime.now()
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE sessions SET 
-                    pr_number = %s, 
-                    pr_url = %s, 
-                    updated_at = %s
-                WHERE id = %s
-            """, (pr_number, pr_url, now, session_id))
-        conn.commit()
-    finally:
-        conn.close()
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE sessions SET 
+                pr_number = %s, 
+                pr_url = %s, 
+                updated_at = %s
+            WHERE id = %s AND (pr_number IS DISTINCT FROM %s OR pr_url IS DISTINCT FROM %s)
+        """, (pr_number, pr_url, now, session_id, pr_number, pr_url))
+        return cur.rowcount == 1
 
 def update_session_state(session_id, state):
-    """Update the state of a session."""
+    """Update the state of a session, logging the transition if it is a real one.
+
+    Returns False if the session was already in `state`, e.g. because another
+    orchestrator replica got there first.
+    """
     now = datetime.now()
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE sessions SET state = %s, updated_at = %s WHERE id = %s
-            """, (state, now, session_id))
-        conn.commit()
-    finally:
-        conn.close()
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            WITH prev AS (SELECT id, state FROM sessions WHERE id = %s FOR UPDATE)
+            UPDATE sessions s SET state = %s, updated_at = %s
+            FROM prev
+            WHERE s.id = prev.id AND prev.state IS DISTINCT FROM %s
+            RETURNING s.repo, prev.state
+        """, (session_id, state, now, state))
+        changed = cur.fetchone()
+    if changed:
+        record_session_event(session_id, changed[0], changed[1], state, now)
+    return bool(changed)
 
 def get_session_by_issue(issue_number, repo):
     """Retrieve the most recent session by issue number and repo."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT * FROM sessions WHERE issue_number = %s AND repo = %s ORDER BY created_at DESC", 
-                (issue_number, repo)
-            )
-            return cur.fetchone()
-    finally:
-        conn.close()
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT * FROM sessions WHERE issue_number = %s AND repo = %s ORDER BY created_at DESC", 
+            (issue_number, repo)
+        )
+        return cur.fetchone()
 
 def get_active_sessions(repo):
-    """Retrieve all sessions that are not merged or failed."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT * FROM sessions WHERE repo = %s AND state NOT IN ('MERGED', 'FAILED')", 
-                (repo,)
-            )
-            return cur.fetchall()
-    finally:
-        conn.close()
+    """Retrieve all sessions that are not merged, failed or closed."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT * FROM sessions WHERE repo = %s AND state NOT IN ('MERGED', 'FAILED', 'CLOSED')", 
+            (repo,)
+        )
+        return cur.fetchall()
 
 def is_paused():
     """Check if the orchestrator is paused."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT value FROM settings WHERE key = 'paused'")
-            row = cur.fetchone()
-            return row[0].lower() == 'true' if row else False
-    finally:
-        conn.close()
+    if _settings_listener and _settings_listener.ready.is_set():
+        value = _settings_listener.get('paused')
+        return value.lower() == 'true' if value else False
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT value FROM settings WHERE key = 'paused'")
+        row = cur.fetchone()
+        return row[0].lower() == 'true' if row else False
 
 def set_paused(paused: bool):
     """Set the paused state."""
@@ -161,35 +469,536 @@ def set_paused(paused: bool):
     set_setting('paused', val)
 
 def set_setting(key, value):
-    """Set a generic setting."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO settings (key, value) VALUES (%s, %s)
-                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
-            """, (key, str(value)))
-        conn.commit()
-    finally:
-        conn.close()
+    """Set a generic setting and notify listeners."""
+    value = str(value)
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO settings (key, value) VALUES (%s, %s)
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """, (key, value))
+        cur.execute("SELECT pg_notify(%s, %s)", (SETTINGS_CHANNEL, json.dumps({"key": key, "value": value})))
+    if _settings_listener:
+        _settings_listener.apply(key, value)
 
 def get_setting(key):
     """Retrieve a generic setting."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT value FROM settings WHERE key = %s", (key,))
-            row = cur.fetchone()
-            return row[0] if row else None
-    finally:
-        conn.close()
+    if _settings_listener and _settings_listener.ready.is_set():
+        return _settings_listener.get(key)
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT value FROM settings WHERE key = %s", (key,))
+        row = cur.fetchone()
+        return row[0] if row else None
 
 def delete_setting(key):
-    """Delete a generic setting."""
-    conn = get_connection()
+    """Delete a generic setting and notify listeners."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM settings WHERE key = %s", (key,))
+        cur.execute("SELECT pg_notify(%s, %s)", (SETTINGS_CHANNEL, json.dumps({"key": key, "value": None})))
+    if _settings_listener:
+        _settings_listener.apply(key, None)
+
+class SettingsListener:
+    """Mirror of the settings table kept current with LISTEN/NOTIFY.
+
+    Holds one dedicated connection. While `ready` is set, get_setting() and
+    is_paused() answer from memory; if the connection drops they fall back
+    to querying until it is re-established and the mirror reloaded.
+    """
+
+    def __init__(self, on_change=None, keepalive=60):
+        self.on_change = on_change  # on_change(key, value) for changes made by other processes
+        self.keepalive = keepalive
+        self.ready = threading.Event()
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, name="settings-listener", daemon=True).start()
+        return self
+
+    def get(self, key):
+        with self._lock:
+            return self._values.get(key)
+
+    def apply(self, key, value):
+        """Update the mirror; returns True if the value changed."""
+        with self._lock:
+            if self._values.get(key) == value:
+                return False
+            if value is None:
+                self._values.pop(key, None)
+            else:
+                self._values[key] = value
+            return True
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = get_connection()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    # Listen before loading so no change can slip in between
+                    cur.execute(f"LISTEN {SETTINGS_CHANNEL}")
+                    cur.execute("SELECT key, value FROM settings")
+                    with self._lock:
+                        self._values = dict(cur.fetchall())
+                self.ready.set()
+                logger.info("Settings listener connected.")
+                self._listen(conn)
+            except Exception as e:
+                self.ready.clear()
+                logger.warning(f"Settings listener disconnected: {e}. Reconnecting in 5s...")
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    ConnectionPool._close(conn)
+
+    def _listen(self, conn):
+        while True:
+            if select.select([conn], [], [], self.keepalive) == ([], [], []):
+                # Quiet channel: make sure the connection is still alive
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                change = json.loads(notify.payload)
+                if self.apply(change['key'], change['value']) and self.on_change:
+                    self.on_change(change['key'], change['value'])
+
+def start_settings_listener(on_change=None):
+    """Serve settings from a LISTEN/NOTIFY-maintained mirror in this process."""
+    global _settings_listener
+    _settings_listener = SettingsListener(on_change).start()
+    _settings_listener.ready.wait(timeout=10)
+    return _settings_listener
+
+def get_recent_sessions(limit=5):
+    """Retrieve the titles and states of the most recently created sessions."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT issue_title, state FROM sessions ORDER BY created_at DESC LIMIT %s", (limit,))
+        return cur.fetchall()
+
+def get_state_counts():
+    """Count sessions per state as (state, count) rows."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT state, COUNT(*) FROM sessions GROUP BY state ORDER BY COUNT(*) DESC")
+        return cur.fetchall()
+
+def get_sessions_page(limit=50, before=None):
+    """Return up to `limit` sessions older than the `before` cursor, newest first.
+
+    The cursor is the (created_at, id) of the last row of the previous page,
+    so every page is an index range scan no matter how deep it is.
+    """
+    with connection() as conn, conn.cursor() as cur:
+        if before:
+            cur.execute("""
+                SELECT * FROM sessions WHERE (created_at, id) < (%s, %s)
+                ORDER BY created_at DESC, id DESC LIMIT %s
+            """, (before[0], before[1], limit))
+        else:
+            cur.execute("SELECT * FROM sessions ORDER BY created_at DESC, id DESC LIMIT %s", (limit,))
+        return cur.fetchall()
+
+def get_throughput_rollup(days=90, period="day", repo=None):
+    """Sessions started, merged and failed per day or week from the rollup table.
+
+    Returns (period_start, started, merged, failed, mean_lead_time_seconds)
+    rows, where lead time runs from session creation to MERGED.
+    """
+    if period not in ("day", "week"):
+        raise ValueError(f"Unsupported period: {period}")
+    since = datetime.now().date() - timedelta(days=days)
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT date_trunc(%s, day)::date AS period, SUM(started), SUM(merged), SUM(failed),
+                   SUM(lead_time_seconds) / NULLIF(SUM(merged), 0)
+            FROM session_daily_stats
+            WHERE day >= %s AND (%s IS NULL OR repo = %s)
+            GROUP BY period
+            ORDER BY period
+        """, (period, since, repo, repo))
+        return cur.fetchall()
+
+def upsert_issue_index(rows):
+    """Insert or refresh (repo, number, title, signature, bands, updated_at) rows."""
+    if not rows:
+        return
+    with connection() as conn, conn.cursor() as cur:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO issue_index (repo, number, title, signature, bands, updated_at) VALUES %s
+            ON CONFLICT (repo, number) DO UPDATE SET
+                title = EXCLUDED.title,
+                signature = EXCLUDED.signature,
+                bands = EXCLUDED.bands,
+                updated_at = EXCLUDED.updated_at
+        """, rows)
+
+def get_issue_signatures(repo):
+    """All indexed issues of a repo as (number, title, signature) rows."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT number, title, signature FROM issue_index WHERE repo = %s", (repo,))
+        return cur.fetchall()
+
+def find_issue_candidates(repo, bands):
+    """Indexed issues sharing at least one LSH band hash, as (number, title, signature) rows."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT number, title, signature FROM issue_index WHERE repo = %s AND bands && %s::bigint[]",
+            (repo, list(bands)),
+        )
+        return cur.fetchall()
+
+def enqueue_notification(chat_id, text):
+    """Add a message to the notification outbox; returns its id."""
+    now = datetime.now()
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO notification_outbox (chat_id, text, created_at, next_attempt_at)
+            VALUES (%s, %s, %s, %s) RETURNING id
+        """, (str(chat_id), text, now, now))
+        return cur.fetchone()[0]
+
+def claim_due_notifications(max_attempts, lease_seconds, limit=100):
+    """Claim unsent outbox rows whose retry time has come, oldest first, as (id, chat_id, text, attempts).
+
+    Claimed rows are pushed `lease_seconds` into the future so other
+    dispatchers (e.g. in orchestrator replicas) skip them; SKIP LOCKED keeps
+    concurrent claims from waiting on or overlapping each other. Rows the
+    caller doesn't get to are handed back with release_notifications.
+    """
+    now = datetime.now()
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            WITH due AS (
+                SELECT id FROM notification_outbox
+                WHERE sent_at IS NULL AND attempts < %s AND next_attempt_at <= %s
+                ORDER BY id LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE notification_outbox o SET next_attempt_at = %s
+            FROM due WHERE o.id = due.id
+            RETURNING o.id, o.chat_id, o.text, o.attempts
+        """, (max_attempts, now, limit, now + timedelta(seconds=lease_seconds)))
+        return sorted(cur.fetchall())
+
+def release_notifications(ids):
+    """Make claimed but unsent rows due again straight away."""
+    if not ids:
+        return
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("UPDATE notification_outbox SET next_attempt_at = %s WHERE id = ANY(%s)", (datetime.now(), list(ids)))
+
+def mark_notifications_sent(ids):
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("UPDATE notification_outbox SET sent_at = %s WHERE id = ANY(%s)", (datetime.now(), list(ids)))
+
+def reschedule_notifications(ids, next_attempt_at, error):
+    """Record a failed delivery and push the rows' next attempt back."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE notification_outbox
+            SET attempts = attempts + 1, next_attempt_at = %s, last_error = %s
+            WHERE id = ANY(%s)
+        """, (next_attempt_at, error, list(ids)))
+
+def pop_setting(key):
+    """Delete a setting and return its value, or None if another process took it first."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM settings WHERE key = %s RETURNING value", (key,))
+        row = cur.fetchone()
+        if row:
+            cur.execute("SELECT pg_notify(%s, %s)", (SETTINGS_CHANNEL, json.dumps({"key": key, "value": None})))
+    if _settings_listener:
+        _settings_listener.apply(key, None)
+    return row[0] if row else None
+
+# Lease times use the database clock so replicas on different hosts agree on expiry
+
+def enqueue_work(repo, issue_number, title, body=None, session_id=None, priority=0):
+    """Queue an issue (or a session to resume) for any worker. Returns False if it was already queued."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO work_queue (repo, issue_number, title, body, session_id, priority, enqueued_at)
+            VALUES (%s, %s, %s, %s, %s, %s, NOW())
+            ON CONFLICT (repo, issue_number) DO NOTHING
+        """, (repo, issue_number, title, body, session_id, priority))
+        return cur.rowcount == 1
+
+def lease_work(worker_id, limit, lease_seconds):
+    """Lease up to `limit` free queue items to `worker_id`, highest priority and oldest first.
+
+    Items whose lease expired (their worker stopped heartbeating) are taken
+    over. SKIP LOCKED lets concurrent workers lease different items without
+    waiting on each other. Returns (repo, issue_number, title, body,
+    session_id, previous_worker_id) rows; previous_worker_id is set for
+    reclaimed items.
+    """
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            WITH picked AS (
+                SELECT repo, issue_number, worker_id FROM work_queue
+                WHERE leased_until IS NULL OR leased_until < NOW()
+                ORDER BY priority DESC, enqueued_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE work_queue w
+            SET worker_id = %s, leased_until = NOW() + make_interval(secs => %s), attempts = w.attempts + 1
+            FROM picked
+            WHERE w.repo = picked.repo AND w.issue_number = picked.issue_number
+            RETURNING w.repo, w.issue_number, w.title, w.body, w.session_id, picked.worker_id
+        """, (limit, worker_id, lease_seconds))
+        return cur.fetchall()
+
+def lease_item(worker_id, repo, issue_number, title, session_id, lease_seconds):
+    """Lease one specific item to `worker_id`, queueing it first if needed.
+
+    Returns False while another worker holds an unexpired lease on it.
+    """
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO work_queue (repo, issue_number, title, session_id, worker_id, leased_until, attempts, enqueued_at)
+            VALUES (%s, %s, %s, %s, %s, NOW() + make_interval(secs => %s), 1, NOW())
+            ON CONFLICT (repo, issue_number) DO UPDATE SET
+                worker_id = EXCLUDED.worker_id,
+                leased_until = EXCLUDED.leased_until,
+                attempts = work_queue.attempts + 1
+            WHERE work_queue.leased_until IS NULL OR work_queue.leased_until < NOW()
+                OR work_queue.worker_id = EXCLUDED.worker_id
+        """, (repo, issue_number, title, session_id, worker_id, lease_seconds))
+        return cur.rowcount == 1
+
+def renew_leases(worker_id, keys, lease_seconds):
+    """Extend this worker's leases on (repo, issue_number) `keys`; returns the keys it still holds."""
+    if not keys:
+        return set()
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE work_queue SET leased_until = NOW() + make_interval(secs => %s)
+            WHERE worker_id = %s AND (repo, issue_number) IN (SELECT * FROM unnest(%s::text[], %s::int[]))
+            RETURNING repo, issue_number
+        """, (lease_seconds, worker_id, [k[0] for k in keys], [k[1] for k in keys]))
+        return {tuple(row) for row in cur.fetchall()}
+
+def set_work_session(repo, issue_number, session_id):
+    """Record the Jules session started for a queued item, so whoever resumes it reuses the session."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "UPDATE work_queue SET session_id = %s WHERE repo = %s AND issue_number = %s",
+            (session_id, repo, issue_number),
+        )
+
+def drop_work(repo, issue_number):
+    """Remove an item from the queue whoever holds it; its worker sees the lost lease and stops."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM work_queue WHERE repo = %s AND issue_number = %s", (repo, issue_number))
+        return cur.rowcount == 1
+
+def release_work(worker_id, repo, issue_number):
+    """Remove a finished item from the queue, unless its lease has passed to another worker."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM work_queue WHERE repo = %s AND issue_number = %s AND worker_id = %s",
+            (repo, issue_number, worker_id),
+        )
+        return cur.rowcount == 1
+
+def get_queued_issues(repo):
+    """Issue numbers queued or leased for a repo."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT issue_number FROM work_queue WHERE repo = %s", (repo,))
+        return {row[0] for row in cur.fetchall()}
+
+def prune_http_cache(max_age_days):
+    """Delete cached responses not refreshed in `max_age_days`; returns how many were removed."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM http_cache WHERE updated_at < %s", (datetime.now() - timedelta(days=max_age_days),))
+        return cur.rowcount
+
+def get_http_cache(url):
+    """Retrieve a cached HTTP response as (etag, last_modified, body, next_url)."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT etag, last_modified, body, next_url FROM http_cache WHERE url = %s", (url,))
+        return cur.fetchone()
+
+def save_http_cache(url, etag, last_modified, body, next_url):
+    """Create or update a cached HTTP response."""
+    now = datetime.now()
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO http_cache (url, etag, last_modified, body, next_url, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (url) DO UPDATE SET
+                etag = EXCLUDED.etag,
+                last_modified = EXCLUDED.last_modified,
+                body = EXCLUDED.body,
+                next_url = EXCLUDED.next_url,
+                updated_at = EXCLUDED.updated_at
+        """, (url, etag, last_modified, body, next_url, now))
+
+def upsert_pull_requests(rows):
+    """Insert or refresh PR index rows.
+
+    Each row is (repo, number, session_id, issue_number, title, head_ref, url, state, updated_at).
+    An existing session link is kept when the new row has none.
+    """
+    if not rows:
+        return
+    with connection() as conn, conn.cursor() as cur:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO pull_requests (repo, number, session_id, issue_number, title, head_ref, url, state, updated_at)
+            VALUES %s
+            ON CONFLICT (repo, number) DO UPDATE SET
+                session_id = COALESCE(EXCLUDED.session_id, pull_requests.session_id),
+                issue_number = EXCLUDED.issue_number,
+                title = EXCLUDED.title,
+                head_ref = EXCLUDED.head_ref,
+                url = EXCLUDED.url,
+                state = EXCLUDED.state,
+                updated_at = EXCLUDED.updated_at
+        """, rows)
+
+def find_pull_request(repo, session_id, issue_number):
+    """Find the indexed PR for a session, falling back to an unlinked PR for its issue.
+
+    Returns (number, url, state, linked_session_id, session_pr_number, mergeable, checks_state) or None.
+    """
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT p.number, p.url, p.state, p.session_id, s.pr_number, p.mergeable, p.checks_state
+            FROM pull_requests p
+            LEFT JOIN sessions s ON s.id = %s
+            WHERE p.repo = %s
+              AND (p.session_id = %s OR (p.session_id IS NULL AND p.issue_number = %s))
+            ORDER BY p.session_id IS NOT NULL DESC, p.number DESC
+            LIMIT 1
+        """, (session_id, repo, session_id, issue_number))
+        return cur.fetchone()
+
+def link_pull_request(repo, number, session_id):
+    """Attach an indexed PR to a session."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "UPDATE pull_requests SET session_id = %s WHERE repo = %s AND number = %s",
+            (session_id, repo, number)
+        )
+
+def update_pull_states(repo, rows):
+    """Refresh state details of indexed PRs from (number, state, url, mergeable, checks_state) rows."""
+    if not rows:
+        return
+    with connection() as conn, conn.cursor() as cur:
+        psycopg2.extras.execute_values(cur, """
+            UPDATE pull_requests AS p SET
+                state = v.state,
+                url = v.url,
+                mergeable = v.mergeable,
+                checks_state = v.checks_state
+            FROM (VALUES %s) AS v (repo, number, state, url, mergeable, checks_state)
+            WHERE p.repo = v.repo AND p.number = v.number
+        """, [(repo,) + tuple(row) for row in rows])
+
+def get_jules_sessions():
+    """Retrieve every indexed Jules session as (id, source, title, issue_number, state, create_time)."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id, source, title, issue_number, state, create_time FROM jules_sessions")
+        return cur.fetchall()
+
+def upsert_jules_sessions(rows):
+    """Insert or refresh indexed Jules sessions from (id, source, title, issue_number, state, create_time) rows."""
+    if not rows:
+        return
+    with connection() as conn, conn.cursor() as cur:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO jules_sessions (id, source, title, issue_number, state, create_time)
+            VALUES %s
+            ON CONFLICT (id) DO UPDATE SET
+                source = COALESCE(EXCLUDED.source, jules_sessions.source),
+                title = COALESCE(EXCLUDED.title, jules_sessions.title),
+                issue_number = COALESCE(EXCLUDED.issue_number, jules_sessions.issue_number),
+                state = EXCLUDED.state,
+                create_time = COALESCE(EXCLUDED.create_time, jules_sessions.create_time)
+        """, rows)
+
+def record_session_event(session_id, repo, from_state, to_state, at=None):
+    """Queue a state transition for the session_events log; flushed in batches."""
+    with _session_events_lock:
+        _session_events.append((session_id, repo, from_state, to_state, at or datetime.now()))
+        full = len(_session_events) >= SESSION_EVENT_BATCH
+    if full:
+        flush_session_events()
+
+def flush_session_events():
+    """Insert all queued session events in one statement."""
+    global _session_events
+    with _session_events_lock:
+        events, _session_events = _session_events, []
+    if not events:
+        return
     try:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM settings WHERE key = %s", (key,))
-        conn.commit()
-    finally:
-        conn.close()
\ No newline at end of file
+        with connection() as conn, conn.cursor() as cur:
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO session_events (session_id, repo, from_state, to_state, created_at) VALUES %s
+            """, events)
+    except Exception:
+        # Put them back so the next flush retries
+        with _session_events_lock:
+            _session_events = events + _session_events
+        raise
+
+atexit.register(flush_session_events)
+
+def get_stage_latencies(days=30, repo=None):
+    """Time spent in each state over the last `days`.
+
+    Returns (state, samples, p50_seconds, p95_seconds) rows; only stays that
+    have ended are counted.
+    """
+    since = datetime.now() - timedelta(days=days)
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT to_state, COUNT(*),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY seconds),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY seconds)
+            FROM (
+                SELECT to_state,
+                       EXTRACT(EPOCH FROM LEAD(created_at) OVER (
+                           PARTITION BY session_id ORDER BY created_at, id
+                       ) - created_at) AS seconds
+                FROM session_events
+                WHERE created_at >= %s AND (%s IS NULL OR repo = %s)
+            ) stays
+            WHERE seconds IS NOT NULL
+            GROUP BY to_state
+            ORDER BY to_state
+        """, (since, repo, repo))
+        return cur.fetchall()
+
+def get_daily_throughput(days=30, repo=None):
+    """Sessions started, merged and failed per day as (day, started, merged, failed) rows."""
+    since = datetime.now() - timedelta(days=days)
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT created_at::date AS day,
+                   COUNT(*) FILTER (WHERE from_state IS NULL),
+                   COUNT(*) FILTER (WHERE to_state = 'MERGED'),
+                   COUNT(*) FILTER (WHERE to_state = 'FAILED')
+            FROM session_events
+            WHERE created_at >= %s AND (%s IS NULL OR repo = %s)
+            GROUP BY day
+            ORDER BY day
+        """, (since, repo, repo))
+        return cur.fetchall()
+
+# Time every query helper when metrics are enabled; plumbing that only hands
+# out connections or threads is left alone
+_UNTIMED = {"get_connection", "get_pool", "connection", "run_async", "start_settings_listener", "record_session_event"}
+if metrics.ENABLED:
+    for _name, _func in list(globals().items()):
+        if inspect.isfunction(_func) and _func.__module__ == __name__ \
+                and not _name.startswith("_") and _name not in _UNTIMED:
+            globals()[_name] = metrics.time_calls(metrics.DB_QUERY_SECONDS, function=_name)(_func)
@@ -0,0 +1,118 @@
+import os
+import re
+import hashlib
+import logging
+from datetime import datetime
+from dotenv import load_dotenv
+import db
+from github_client import get_client as get_github
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Estimated Jaccard similarity at which a generated idea counts as a duplicate
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.5"))
+# Existing issues shown to the LLM as "don't duplicate these"
+DEDUP_PROMPT_NEIGHBOURS = int(os.getenv("DEDUP_PROMPT_NEIGHBOURS", "15"))
+# Leading body characters that go into an issue's signature alongside its title
+BODY_CHARS = 500
+
+# 16 bands of 4 rows put the LSH candidate threshold at roughly 0.5
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % (_PRIME - 1) + 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _PRIME)
+    for i in range(NUM_PERM)
+]
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "with", "by", "is", "be", "as",
+    "at", "it", "this", "that", "from", "into", "add", "support", "new",
+}
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big") >> 1
+
+def shingles(title, body=""):
+    """Word unigrams and bigrams of the title and the start of the body."""
+    # Persona prefixes like "[Product Manager] " are the same across unrelated ideas
+    title = re.sub(r"^\[[^\]]*\]\s*", "", title or "")
+    words = [w for w in re.findall(r"[a-z0-9]+", f"{title} {(body or '')[:BODY_CHARS]}".lower())
+             if w not in STOPWORDS]
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+def signature(title, body=""):
+    """MinHash signature of an issue as NUM_PERM integers."""
+    hashes = [_hash64(s) for s in shingles(title, body)] or [0]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+def band_hashes(sig):
+    """One LSH hash per band, tagged with the band number so bands never collide with each other."""
+    return [_hash64(f"{band}:" + ",".join(map(str, sig[band * ROWS:(band + 1) * ROWS]))) for band in range(BANDS)]
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+def _row(repo, issue):
+    sig = signature(issue['title'], issue.get('body', ''))
+    updated = issue.get('updatedAt')
+    updated = datetime.fromisoformat(updated.replace("Z", "+00:00")) if updated else datetime.now()
+    return (repo, issue['number'], issue['title'], sig, band_hashes(sig), updated)
+
+def sync(repo):
+    """Bring the repo's index up to date with issues updated since the last sync."""
+    key = f"issue_index_synced:{repo}"
+    since = db.get_setting(key)
+    issues = get_github().list_issues(repo, state="all", since=since)
+    for start in range(0, len(issues), 500):
+        db.upsert_issue_index([_row(repo, issue) for issue in issues[start:start + 500]])
+    if issues:
+        # Issues updated in the same second as the cursor are listed again next time; upserts make that harmless
+        db.set_setting(key, max(issue['updatedAt'] for issue in issues if issue.get('updatedAt')))
+    logger.info(f"Issue index for {repo}: {len(issues)} issue(s) {'refreshed' if since else 'indexed'}.")
+
+def add(repo, issues):
+    """Index freshly created issues without waiting for the next sync."""
+    db.upsert_issue_index([_row(repo, issue) for issue in issues])
+
+def find_duplicates(repo, title, body="", threshold=DEDUP_THRESHOLD):
+    """Indexed issues at least `threshold` similar, as (number, title, score), best first."""
+    sig = signature(title, body)
+    matches = []
+    for number, existing_title, existing_sig in db.find_issue_candidates(repo, band_hashes(sig)):
+        score = similarity(sig, existing_sig)
+        if score >= threshold:
+            matches.append((number, existing_title, score))
+    return sorted(matches, key=lambda m: -m[2])
+
+def nearest(repo, text, k=DEDUP_PROMPT_NEIGHBOURS):
+    """The `k` indexed issue titles most similar to `text`, most recent first on ties."""
+    sig = signature(text)
+    scored = [(similarity(sig, s), number, title) for number, title, s in db.get_issue_signatures(repo)]
+    scored.sort(key=lambda item: (-item[0], -item[1]))
+    return [title for _, _, title in scored[:k]]
+
+def filter_ideas(repo, ideas, threshold=DEDUP_THRESHOLD):
+    """Split generated ideas into (new, duplicates).
+
+    An idea is a duplicate if it matches an indexed issue or an earlier idea
+    in the same batch.
+    """
+    kept, dropped, batch = [], [], []
+    for idea in ideas:
+        sig = signature(idea['title'], idea.get('body', ''))
+        existing = find_duplicates(repo, idea['title'], idea.get('body', ''), threshold)
+        if existing:
+            number, title, score = existing[0]
+            logger.info(f"Skipping duplicate idea '{idea['title']}' (~{score:.0%} like #{number} '{title}')")
+            dropped.append(idea)
+        elif any(similarity(sig, other) >= threshold for other in batch):
+            logger.info(f"Skipping idea '{idea['title']}': repeats another idea in this batch")
+            dropped.append(idea)
+        else:
+            kept.append(idea)
+            batch.append(sig)
+    return kept, dropped
@@ -0,0 +1,432 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import db
+import metrics
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Point at a local fake server for testing, or at a GitHub Enterprise API
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+GITHUB_GRAPHQL_URL = os.getenv("GITHUB_GRAPHQL_URL", f"{GITHUB_API_URL}/graphql")
+GITHUB_TIMEOUT = float(os.getenv("GITHUB_TIMEOUT", "30"))
+# Pull requests resolved per GraphQL request
+GRAPHQL_PAGE_SIZE = int(os.getenv("GRAPHQL_PAGE_SIZE", "50"))
+# Keep ETag-validated responses in Postgres so they survive restarts
+GITHUB_CACHE_PERSIST = os.getenv("GITHUB_CACHE_PERSIST", "true").lower() == "true"
+GITHUB_CACHE_SIZE = int(os.getenv("GITHUB_CACHE_SIZE", "1000"))
+# Persisted entries not refreshed for this many days are pruned
+GITHUB_CACHE_MAX_AGE_DAYS = float(os.getenv("GITHUB_CACHE_MAX_AGE_DAYS", "7"))
+CACHE_PRUNE_INTERVAL = 3600
+# Log the hit rate every this many GETs
+CACHE_LOG_EVERY = 500
+# Bulk issue creation: parallel requests, and minimum seconds between creates
+# (GitHub's secondary limits allow roughly one content-creating request per second)
+GITHUB_BULK_WORKERS = int(os.getenv("GITHUB_BULK_WORKERS", "3"))
+GITHUB_CREATE_INTERVAL = float(os.getenv("GITHUB_CREATE_INTERVAL", "1"))
+
+class GitHubError(Exception):
+    """Raised when a GitHub API call fails.
+
+    `retry_after` is the number of seconds to wait when the failure was a
+    primary or secondary rate limit, otherwise None.
+    """
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class Throttle:
+    """Spaces calls shared by several threads at least `interval` seconds apart."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+    def pause(self, seconds):
+        """Hold every caller back for `seconds`."""
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+class ResponseCache:
+    """Conditional-request cache for GET responses, keyed by full URL.
+
+    Entries hold the validators (ETag / Last-Modified) plus the decoded body
+    and next-page link. Memory is an LRU bounded by `maxsize`; with `persist`
+    set, entries are also written through to the http_cache table, which is
+    pruned of entries older than GITHUB_CACHE_MAX_AGE_DAYS.
+    """
+
+    def __init__(self, maxsize=GITHUB_CACHE_SIZE, persist=GITHUB_CACHE_PERSIST):
+        self.maxsize = maxsize
+        self.persist = persist
+        self.hits = 0
+        self.misses = 0
+        self._pruned_at = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """Return (etag, last_modified, data, next_url) for a URL, or None."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry:
+                self._entries.move_to_end(url)
+                return entry
+        if not self.persist:
+            return None
+        try:
+            row = db.get_http_cache(url)
+        except Exception as e:
+            logger.warning(f"HTTP cache lookup failed for {url}: {e}")
+            return None
+        if not row:
+            return None
+        entry = (row[0], row[1], json.loads(row[2]), row[3])
+        self._remember(url, entry)
+        return entry
+
+    def put(self, url, etag, last_modified, data, next_url, persist=True):
+        """Cache a response; `persist=False` keeps it in memory only."""
+        entry = (etag, last_modified, data, next_url)
+        self._remember(url, entry)
+        if self.persist and persist:
+            try:
+                db.save_http_cache(url, etag, last_modified, json.dumps(data), next_url)
+                self._prune()
+            except Exception as e:
+                logger.warning(f"HTTP cache write failed for {url}: {e}")
+
+    def record(self, hit):
+        metrics.GITHUB_CACHE_LOOKUPS.inc(result="hit" if hit else "miss")
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            total = self.hits + self.misses
+            if total % CACHE_LOG_EVERY:
+                return
+            hits = self.hits
+        logger.info(f"GitHub response cache: {hits}/{total} GETs answered by 304 ({hits / total:.0%})")
+
+    def _prune(self):
+        now = time.monotonic()
+        if self._pruned_at is not None and now - self._pruned_at < CACHE_PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        removed = db.prune_http_cache(GITHUB_CACHE_MAX_AGE_DAYS)
+        if removed:
+            logger.info(f"Pruned {removed} stale HTTP cache entries.")
+
+    def stats(self):
+        """Return hit/miss counters since the process started."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _remember(self, url, entry):
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+class GitHubClient:
+    """Small GitHub REST client over one persistent keep-alive session.
+
+    Issues and pull requests are returned in the same shape `gh --json`
+    produced (number, title, body, url, state, headRefName), so callers
+    written against the CLI keep working.
+    """
+
+    def __init__(self, token=None, base_url=GITHUB_API_URL, timeout=GITHUB_TIMEOUT, cache=None,
+                 graphql_url=None):
+        self.base_url = base_url.rstrip("/")
+        self.graphql_url = graphql_url or (GITHUB_GRAPHQL_URL if base_url == GITHUB_API_URL else f"{self.base_url}/graphql")
+        self.timeout = timeout
+        self.cache = cache if cache is not None else ResponseCache()
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=16))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=16))
+        self.session.headers.update({
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+            "User-Agent": "octo-jules",
+        })
+        if metrics.ENABLED:
+            metrics.instrument_session(
+                self.session, metrics.GITHUB_REQUEST_SECONDS, metrics.GITHUB_REQUEST_ERRORS,
+                lambda method, url: f"{method} {metrics.path_template(url)}",
+            )
+        token = token or os.getenv("GH_TOKEN") or os.getenv("GITHUB_TOKEN")
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def request(self, method, path, **kwargs):
+        """Send a request and return the response, raising GitHubError on failure."""
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise GitHubError(f"{method} {url} failed: {e}") from e
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise GitHubError(
+                f"{method} {url} returned {response.status_code}: {message}",
+                response.status_code, rate_limit_delay(response),
+            )
+        return response
+
+    def get_json(self, path, params=None):
+        """GET a resource and return (data, next_page_url).
+
+        Requests carry If-None-Match / If-Modified-Since from the cache, so an
+        unchanged resource comes back as a 304 that doesn't count against the
+        rate limit and is served from the cached body.
+        """
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        url = requests.Request("GET", url, params=params).prepare().url
+        cached = self.cache.get(url)
+        headers = {}
+        if cached:
+            etag, last_modified = cached[0], cached[1]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = self.request("GET", url, headers=headers)
+        if response.status_code == 304 and cached:
+            self.cache.record(hit=True)
+            return cached[2], cached[3]
+
+        self.cache.record(hit=False)
+        data = response.json()
+        next_url = response.links.get("next", {}).get("url")
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if etag or last_modified:
+            # `since=` cursor queries change on every sync, so a persisted copy would never be read again
+            self.cache.put(url, etag, last_modified, data, next_url, persist="since=" not in url)
+        return data, next_url
+
+    def paginate(self, path, params=None, limit=None):
+        """Yield items from a list endpoint, following `Link: rel=next` headers."""
+        params = dict(params or {})
+        params.setdefault("per_page", min(limit or 100, 100))
+        url, count = path, 0
+        while url:
+            items, url = self.get_json(url, params)
+            for item in items:
+                yield item
+                count += 1
+                if limit and count >= limit:
+                    return
+            params = None  # the next link already carries the query string
+
+    def graphql(self, query, variables=None):
+        """Run a GraphQL query and return its `data`, raising GitHubError if there is none."""
+        payload = self.request("POST", self.graphql_url, json={"query": query, "variables": variables or {}}).json()
+        if payload.get("errors"):
+            messages = "; ".join(err.get("message", "") for err in payload["errors"])
+            if not payload.get("data"):
+                raise GitHubError(f"GraphQL query failed: {messages}")
+            logger.warning(f"GraphQL query returned partial data: {messages}")
+        return payload["data"]
+
+    # Issues
+
+    def list_issues(self, repo, labels=None, state="open", limit=None, since=None):
+        """List issues (not pull requests) in a repo, newest first.
+
+        With `since` (an ISO 8601 timestamp) only issues updated at or after
+        it are listed, oldest update first.
+        """
+        params = {"state": state}
+        if labels:
+            params["labels"] = labels
+        if since:
+            params.update(since=since, sort="updated", direction="asc")
+        issues = []
+        for item in self.paginate(f"/repos/{repo}/issues", params):
+            if "pull_request" in item:
+                continue
+            issues.append(issue_from_api(item))
+            if limit and len(issues) >= limit:
+                break
+        return issues
+
+    def get_issue(self, repo, number):
+        return issue_from_api(self.get_json(f"/repos/{repo}/issues/{number}")[0])
+
+    def create_issue(self, repo, title, body="", labels=None):
+        payload = {"title": title, "body": body}
+        if labels:
+            payload["labels"] = list(labels)
+        return issue_from_api(self.request("POST", f"/repos/{repo}/issues", json=payload).json())
+
+    def create_issues(self, repo, items, labels=None, workers=GITHUB_BULK_WORKERS, retries=3):
+        """Create many issues with bounded parallelism.
+
+        `items` are dicts with "title" and optional "body". Creates are spaced
+        GITHUB_CREATE_INTERVAL apart across all workers, and a rate-limit
+        response pauses every worker for as long as GitHub asks before the
+        item is retried. Returns one entry per item, in order: the created
+        issue, or the exception that made it fail (usually a GitHubError).
+        """
+        throttle = Throttle(GITHUB_CREATE_INTERVAL)
+
+        def create(item):
+            for attempt in range(retries + 1):
+                throttle.wait()
+                try:
+                    return self.create_issue(repo, item["title"], item.get("body", ""), labels=labels)
+                except GitHubError as e:
+                    if e.retry_after is None or attempt == retries:
+                        return e
+                    logger.warning(f"Rate limited creating '{item['title']}'; pausing {e.retry_after:.0f}s")
+                    throttle.pause(e.retry_after)
+                except Exception as e:
+                    # Returned in place so one bad item can't hide the issues already created
+                    return e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(items)))) as pool:
+            return list(pool.map(create, items))
+
+    def close_issue(self, repo, number, comment=None):
+        if comment:
+            self.request("POST", f"/repos/{repo}/issues/{number}/comments", json={"body": comment})
+        return issue_from_api(self.request("PATCH", f"/repos/{repo}/issues/{number}", json={"state": "closed"}).json())
+
+    # Pull requests
+
+    def list_pulls(self, repo, state="all", limit=None):
+        """List pull requests in a repo, newest first."""
+        return list(self.iter_pulls(repo, state=state, limit=limit))
+
+    def iter_pulls(self, repo, state="all", sort="created", limit=None):
+        """Lazily yield pull requests, newest first by `sort` (created or updated)."""
+        params = {"state": state, "sort": sort, "direction": "desc"}
+        for item in self.paginate(f"/repos/{repo}/pulls", params, limit=limit):
+            yield pull_from_api(item)
+
+    def get_pull(self, repo, number):
+        return pull_from_api(self.get_json(f"/repos/{repo}/pulls/{number}")[0])
+
+    def get_pull_states(self, repo, numbers, page_size=GRAPHQL_PAGE_SIZE):
+        """Resolve state, mergeability and CI status of many PRs with one GraphQL request per page.
+
+        Returns {number: {"state", "url", "mergeable", "checks"}}; PRs that
+        don't exist are left out.
+        """
+        owner, name = repo.split("/")
+        numbers = sorted({int(n) for n in numbers})
+        states = {}
+        for start in range(0, len(numbers), page_size):
+            chunk = numbers[start:start + page_size]
+            fields = "\n".join(f"pr{n}: pullRequest(number: {n}) {{ ...prState }}" for n in chunk)
+            query = f"""
+                query($owner: String!, $name: String!) {{
+                  repository(owner: $owner, name: $name) {{
+                    {fields}
+                  }}
+                }}
+                fragment prState on PullRequest {{
+                  number
+                  state
+                  url
+                  mergeable
+                  commits(last: 1) {{ nodes {{ commit {{ statusCheckRollup {{ state }} }} }} }}
+                }}
+            """
+            data = self.graphql(query, {"owner": owner, "name": name})
+            for node in (data.get("repository") or {}).values():
+                if not node:
+                    continue
+                commits = node["commits"]["nodes"]
+                rollup = commits[0]["commit"]["statusCheckRollup"] if commits else None
+                states[node["number"]] = {
+                    "state": node["state"],
+                    "url": node["url"],
+                    "mergeable": node["mergeable"],
+                    "checks": rollup["state"] if rollup else None,
+                }
+        return states
+
+    def merge_pull(self, repo, number, method="merge", delete_branch=False):
+        """Merge a pull request, optionally deleting its head branch afterwards."""
+        result = self.request("PUT", f"/repos/{repo}/pulls/{number}/merge", json={"merge_method": method}).json()
+        if delete_branch:
+            pr = self.get_pull(repo, number)
+            try:
+                self.request("DELETE", f"/repos/{repo}/git/refs/heads/{pr['headRefName']}")
+            except GitHubError as e:
+                logger.warning(f"Merged PR #{number} but could not delete branch {pr['headRefName']}: {e}")
+        return result
+
+def rate_limit_delay(response):
+    """Seconds to back off if `response` is a primary or secondary rate limit, else None."""
+    if response.status_code not in (403, 429):
+        return None
+    if response.headers.get("Retry-After", "").isdigit():
+        return float(response.headers["Retry-After"])
+    if response.headers.get("X-RateLimit-Remaining") == "0" and response.headers.get("X-RateLimit-Reset", "").isdigit():
+        return max(float(response.headers["X-RateLimit-Reset"]) - time.time(), 1)
+    if response.status_code == 429 or "rate limit" in response.text.lower():
+        # Secondary limits without a hint: GitHub suggests waiting at least a minute
+        return 60.0
+    return None
+
+def issue_from_api(data):
+    """Convert a REST issue payload to the gh --json shape."""
+    return {
+        "number": data["number"],
+        "title": data["title"],
+        "body": data.get("body") or "",
+        "url": data["html_url"],
+        "state": data["state"].upper(),
+        "updatedAt": data.get("updated_at"),
+    }
+
+def pull_from_api(data):
+    """Convert a REST (or webhook) pull request payload to the gh --json shape."""
+    return {
+        "number": data["number"],
+        "title": data["title"],
+        "body": data.get("body") or "",
+        "url": data["html_url"],
+        "headRefName": data["head"]["ref"],
+        "state": "MERGED" if data.get("merged_at") else data["state"].upper(),
+        "updatedAt": data.get("updated_at"),
+    }
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide GitHub client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GitHubClient()
+    return _client
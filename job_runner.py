@@ -0,0 +1,193 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Jobs allowed to run at once; the rest wait in line
+JOB_MAX_CONCURRENT = int(os.getenv("JOB_MAX_CONCURRENT", "2"))
+# Minimum seconds between progress callbacks for one job (each one is a Telegram message edit)
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "5"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "1800"))
+# Seconds a cancelled job gets to exit after SIGTERM before it is killed
+JOB_KILL_GRACE = 5
+JOB_HISTORY = 10
+TAIL_LINES = 8
+MAX_LINE_LENGTH = 200
+FINISHED = ("succeeded", "failed", "cancelled")
+
+class Job:
+    """One subprocess run by the JobRunner.
+
+    `status` moves from queued to running to succeeded, failed or cancelled;
+    `output` holds the last TAIL_LINES lines it printed.
+    """
+
+    def __init__(self, job_id, name, cmd):
+        self.id = job_id
+        self.name = name
+        self.cmd = cmd
+        self.status = "queued"
+        self.returncode = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.output = deque(maxlen=TAIL_LINES)
+        self.cancel_requested = False
+        self._process = None
+        self._task = None
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    @property
+    def elapsed(self):
+        """Seconds spent running so far (or in total, once finished)."""
+        if self.started_at is None:
+            return 0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def tail(self):
+        return "\n".join(self.output)
+
+class JobRunner:
+    """Runs commands as asyncio subprocesses without blocking the event loop.
+
+    `on_update(job)` is awaited when a job starts, at most every
+    `progress_interval` seconds while it prints output, and once it finishes.
+    Finished jobs are kept for /jobs until JOB_HISTORY newer ones replace them.
+    """
+
+    def __init__(self, max_concurrent=JOB_MAX_CONCURRENT, progress_interval=JOB_PROGRESS_INTERVAL, timeout=JOB_TIMEOUT):
+        self.progress_interval = progress_interval
+        self.timeout = timeout
+        self.jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    def submit(self, name, cmd, on_update=None, cwd=None):
+        """Queue `cmd` (an argv list) and return its Job immediately."""
+        job = Job(next(self._ids), name, cmd)
+        self.jobs[job.id] = job
+        job._task = asyncio.create_task(self._run(job, on_update, cwd))
+        self._prune()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def active(self):
+        return [job for job in self.jobs.values() if not job.done]
+
+    async def cancel(self, job_id):
+        """Stop a queued or running job. Returns False if there was nothing to cancel."""
+        job = self.jobs.get(job_id)
+        if job is None or job.done:
+            return False
+        job.cancel_requested = True
+        if job._process is None:
+            # Still waiting for a slot (or about to start); its task sees the flag
+            if job.status == "queued":
+                job._task.cancel()
+            return True
+        await self._terminate(job)
+        return True
+
+    async def _run(self, job, on_update, cwd):
+        try:
+            async with self._slots:
+                if job.cancel_requested:
+                    raise asyncio.CancelledError
+                job.status, job.started_at = "running", time.monotonic()
+                await self._notify(job, on_update)
+                logger.info(f"Job {job.id} ({job.name}) started: {' '.join(job.cmd)}")
+                try:
+                    job._process = await asyncio.create_subprocess_exec(
+                        *job.cmd, cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                        start_new_session=True, limit=2 ** 20,
+                    )
+                except OSError as e:
+                    job.output.append(f"Could not start: {e}")
+                    job.status = "failed"
+                    return
+
+                if job.cancel_requested:
+                    await self._terminate(job)
+                reader = asyncio.create_task(self._read(job, on_update))
+                try:
+                    await asyncio.wait_for(job._process.wait(), self.timeout)
+                except asyncio.TimeoutError:
+                    job.output.append(f"Timed out after {self.timeout:.0f}s")
+                    await self._terminate(job)
+                await reader
+                job.returncode = job._process.returncode
+                if job.cancel_requested:
+                    job.status = "cancelled"
+                else:
+                    job.status = "succeeded" if job.returncode == 0 else "failed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.name}) crashed: {e}")
+            job.output.append(f"Error: {e}")
+            job.status = "failed"
+        finally:
+            if not job.done:
+                job.status = "failed"
+            job.finished_at = time.monotonic()
+            logger.info(f"Job {job.id} ({job.name}) {job.status} (exit {job.returncode})")
+            await self._notify(job, on_update)
+
+    async def _read(self, job, on_update):
+        """Collect the job's output, reporting progress at most every progress_interval."""
+        last_update = time.monotonic()
+        while True:
+            try:
+                line = await job._process.stdout.readline()
+            except ValueError:
+                # A line longer than the stream limit; skip it rather than stop reading
+                continue
+            if not line:
+                return
+            line = line.decode(errors="replace").rstrip()
+            if line:
+                job.output.append(line[:MAX_LINE_LENGTH])
+            if time.monotonic() - last_update >= self.progress_interval:
+                last_update = time.monotonic()
+                await self._notify(job, on_update)
+
+    async def _terminate(self, job):
+        """SIGTERM the job's process group, then SIGKILL it if it doesn't exit in time."""
+        process = job._process
+        if process.returncode is not None:
+            return
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(process.pid, sig)
+            except ProcessLookupError:
+                return
+            try:
+                await asyncio.wait_for(process.wait(), JOB_KILL_GRACE)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+    async def _notify(self, job, on_update):
+        if on_update is None:
+            return
+        try:
+            await on_update(job)
+        except Exception as e:
+            logger.warning(f"Progress update for job {job.id} failed: {e}")
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(len(finished) - JOB_HISTORY, 0)]:
+            del self.jobs[job_id]
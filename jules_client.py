@@ -0,0 +1,184 @@
+import os
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Point at a local fake server for testing
+JULES_API_BASE = os.getenv("JULES_API_BASE", "https://jules.googleapis.com/v1alpha").rstrip("/")
+JULES_CONNECT_TIMEOUT = float(os.getenv("JULES_CONNECT_TIMEOUT", "5"))
+JULES_READ_TIMEOUT = float(os.getenv("JULES_READ_TIMEOUT", "30"))
+# Upper bound on one call including its retries
+JULES_DEADLINE = float(os.getenv("JULES_DEADLINE", "90"))
+JULES_RETRIES = int(os.getenv("JULES_RETRIES", "3"))
+JULES_RETRY_BACKOFF = float(os.getenv("JULES_RETRY_BACKOFF", "1"))
+# Consecutive failures that open the breaker, and how long it stays open
+JULES_BREAKER_THRESHOLD = int(os.getenv("JULES_BREAKER_THRESHOLD", "5"))
+JULES_BREAKER_COOLDOWN = float(os.getenv("JULES_BREAKER_COOLDOWN", "60"))
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class JulesError(Exception):
+    """Raised when a Jules API call fails."""
+
+    def __init__(self, message, status=None, body=""):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+class CircuitOpenError(JulesError):
+    """Raised without calling the API while the circuit breaker is open."""
+
+    def __init__(self, retry_in):
+        super().__init__(f"Jules API circuit open; retrying in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """Fails fast after `threshold` consecutive failures.
+
+    After `cooldown` seconds one trial call is let through (half-open);
+    its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, threshold=JULES_BREAKER_THRESHOLD, cooldown=JULES_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial:
+                raise CircuitOpenError(max(remaining, 0))
+            self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Jules API recovered; circuit closed.")
+            self.failures, self._opened_at, self._trial = 0, None, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self._opened_at is None and self.failures >= self.threshold):
+                logger.warning(f"Jules API failing ({self.failures} in a row); circuit open for {self.cooldown:.0f}s.")
+                self._opened_at, self._trial = time.monotonic(), False
+
+class JulesClient:
+    """Jules REST client over one keep-alive session.
+
+    Every call has connect/read timeouts and an overall deadline. GETs are
+    retried with exponential backoff on connection errors, 429 and 5xx;
+    POSTs are sent once, since creating a session isn't idempotent. Outages
+    open the circuit breaker so callers fail fast instead of piling on.
+    """
+
+    def __init__(self, api_key=None, base_url=JULES_API_BASE, breaker=None,
+                 timeout=(JULES_CONNECT_TIMEOUT, JULES_READ_TIMEOUT), deadline=JULES_DEADLINE,
+                 retries=JULES_RETRIES):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=16))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=16))
+        self.session.headers["x-goog-api-key"] = api_key or os.getenv("JULES_API_KEY") or ""
+        if metrics.ENABLED:
+            prefix = requests.utils.urlparse(self.base_url).path
+            metrics.instrument_session(
+                self.session, metrics.JULES_REQUEST_SECONDS, metrics.JULES_REQUEST_ERRORS,
+                lambda method, url: f"{method} {metrics.path_template(url, prefix=prefix)}",
+            )
+
+    def request(self, method, path, **kwargs):
+        """Send a request and return the decoded JSON body, raising JulesError on failure."""
+        url = f"{self.base_url}{path}"
+        attempts = 1 + (self.retries if method == "GET" else 0)
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(1, attempts + 1):
+            self.breaker.before_call()
+            remaining = deadline - time.monotonic()
+            timeout = (max(min(self.timeout[0], remaining), 0.1), max(min(self.timeout[1], remaining), 0.1))
+            retry_after = None
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                error = JulesError(f"{method} {url} failed: {e}")
+            else:
+                if response.status_code < 400:
+                    self.breaker.record_success()
+                    return response.json()
+                error = JulesError(
+                    f"{method} {url} returned {response.status_code}: {response.text[:500]}",
+                    response.status_code, response.text,
+                )
+                if response.status_code not in RETRYABLE_STATUSES:
+                    # The API answered; a bad request says nothing about its health
+                    self.breaker.record_success()
+                    raise error
+                retry_after = response.headers.get("Retry-After")
+
+            self.breaker.record_failure()
+            delay = float(retry_after) if retry_after and retry_after.isdigit() \
+                else JULES_RETRY_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            if attempt == attempts or self.breaker.state == "open" or time.monotonic() + delay >= deadline:
+                raise error
+            logger.warning(f"{error}. Retrying in {delay:.1f}s ({attempt}/{attempts - 1})")
+            time.sleep(delay)
+
+    def list_sources(self):
+        """Yield every source, following pageToken."""
+        params = {}
+        while True:
+            data = self.request("GET", "/sources", params=params)
+            yield from data.get("sources", [])
+            if not data.get("nextPageToken"):
+                return
+            params = {"pageToken": data["nextPageToken"]}
+
+    def list_sessions(self, page_token=None, page_size=100):
+        """Fetch one page of the session listing."""
+        params = {"pageSize": page_size}
+        if page_token:
+            params["pageToken"] = page_token
+        return self.request("GET", "/sessions", params=params)
+
+    def get_session(self, session_id):
+        return self.request("GET", f"/sessions/{session_id}")
+
+    def create_session(self, payload):
+        return self.request("POST", "/sessions", json=payload)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide Jules client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = JulesClient()
+    return _client
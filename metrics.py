@@ -0,0 +1,226 @@
+import os
+import re
+import time
+import functools
+import logging
+import threading
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# The endpoint only starts, and metrics are only recorded, when a port is configured
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+ENABLED = bool(METRICS_PORT)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in key) + "}"
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    """Monotonic counter, one series per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name, self.help = name, help
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        """Context manager that observes the duration of its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        out = []
+        for key, values in series.items():
+            for bound, count in zip(self.buckets, values):
+                out.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), count))
+            out.append((f"{self.name}_bucket", key + (("le", "+Inf"),), values[-1]))
+            out.append((f"{self.name}_sum", key, values[-2]))
+            out.append((f"{self.name}_count", key, values[-1]))
+        return out
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+# Orchestrator metrics
+
+JULES_REQUEST_SECONDS = Histogram("octo_jules_jules_request_seconds", "Jules API request latency by endpoint.")
+JULES_REQUEST_ERRORS = Counter("octo_jules_jules_request_errors_total", "Failed Jules API requests by endpoint.")
+GITHUB_REQUEST_SECONDS = Histogram("octo_jules_github_request_seconds", "GitHub API request latency by endpoint.")
+GITHUB_REQUEST_ERRORS = Counter("octo_jules_github_request_errors_total", "Failed GitHub API requests by endpoint.")
+GITHUB_CACHE_LOOKUPS = Counter("octo_jules_github_cache_lookups_total", "GitHub GETs by cache result (hit = 304).")
+DB_QUERY_SECONDS = Histogram("octo_jules_db_query_seconds", "Time spent in each db.py helper.")
+JULES_POLLS = Counter("octo_jules_session_polls_total", "Jules status polls by observed state.")
+SESSION_POLLS = Histogram(
+    "octo_jules_polls_per_session", "Status polls a session needed before finishing.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+BACKLOG_DEPTH = Gauge("octo_jules_backlog_depth", "Open labelled issues not yet handed to Jules, by repo.")
+RUNNING_SESSIONS = Gauge("octo_jules_running_sessions", "Sessions currently driven by a worker.")
+LOOP_SECONDS = Histogram("octo_jules_loop_iteration_seconds", "Duration of one orchestrator scheduling pass.")
+
+def render():
+    """Return every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def time_calls(histogram, **labels):
+    """Decorator observing each call's duration."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+def instrument_session(session, histogram, errors, endpoint):
+    """Time every request a requests.Session sends, labelled by endpoint(method, url).
+
+    Exceptions and 4xx/5xx responses also count as errors.
+    """
+    send = session.request
+
+    def request(method, url, *args, **kwargs):
+        label = endpoint(method, url)
+        start = time.perf_counter()
+        try:
+            response = send(method, url, *args, **kwargs)
+        except Exception:
+            errors.inc(endpoint=label)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start, endpoint=label)
+        if response.status_code >= 400:
+            errors.inc(endpoint=label)
+        return response
+
+    session.request = request
+    return session
+
+def path_template(url, prefix=""):
+    """Collapse ids in a URL path so labels stay low-cardinality.
+
+    "/repos/o/r/pulls/12" becomes "/repos/{repo}/pulls/{n}"; anything after
+    "sessions/" or "refs/heads/" is treated as an id.
+    """
+    path = urlsplit(url).path
+    if prefix and path.startswith(prefix):
+        path = path[len(prefix):]
+    path = re.sub(r"^/repos/[^/]+/[^/]+", "/repos/{repo}", path)
+    path = re.sub(r"/refs/heads/.+$", "/refs/heads/{branch}", path)
+    path = re.sub(r"/sessions/[^/:]+", "/sessions/{id}", path)
+    return re.sub(r"/\d+(?=/|$)", "/{n}", path) or "/"
+
+def make_handler():
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def do_GET(self):
+            if self.path != METRICS_PATH:
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return MetricsHandler
+
+def start(port=METRICS_PORT):
+    """Serve metrics on a background thread. Returns the server, or None when disabled."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", int(port)), make_handler())
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on :{port}{METRICS_PATH}")
+    return server
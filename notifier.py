@@ -1,55 +1,240 @@
 import os
+import time
+import random
 import requests
 import logging
+import threading
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
+import db
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "10"))
+# Telegram allows about one message per second per chat and 20 per minute in groups
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "3"))
+# Messages queued within this window of each other go out as one digest
+NOTIFY_COALESCE_WINDOW = float(os.getenv("NOTIFY_COALESCE_WINDOW", "2"))
+# How often the outbox is checked for retries and rows written by other processes
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", "15"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+NOTIFY_BACKOFF_BASE = float(os.getenv("NOTIFY_BACKOFF_BASE", "5"))
+NOTIFY_BACKOFF_MAX = float(os.getenv("NOTIFY_BACKOFF_MAX", "900"))
+# How long claimed rows are hidden from other dispatchers while a send is in flight
+NOTIFY_CLAIM_SECONDS = 60
+TELEGRAM_MAX_LENGTH = 4096
+DIGEST_SEPARATOR = "\n\n— — —\n\n"
+
+_dispatcher = None
+
+class TelegramError(Exception):
+    """A sendMessage call failed; `retry_after` is set when Telegram asked us to slow down."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def post_message(chat_id, text, parse_mode="Markdown", http=requests):
+    """Call sendMessage once, raising TelegramError on failure."""
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    payload = {"chat_id": chat_id, "text": text}
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    try:
+        response = http.post(url, json=payload, timeout=TELEGRAM_TIMEOUT)
+    except requests.RequestException as e:
+        raise TelegramError(f"sendMessage failed: {e}") from e
+    if response.status_code != 200:
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        raise TelegramError(
+            f"sendMessage returned {response.status_code}: {body.get('description', response.text)}",
+            response.status_code, body.get("parameters", {}).get("retry_after"),
+        )
+
+def truncate(text, limit):
+    if len(text) <= limit:
+        return text
+    return text[:limit - 16].rstrip() + "\n… (truncated)"
+
+def digest(texts, limit=TELEGRAM_MAX_LENGTH - 64):
+    """Join as many leading queued texts as fit in one Telegram message.
+
+    Returns (count, text), `count` being how many queued messages it covers;
+    the first text is always included. Texts over `limit` are truncated so
+    an oversized message can't be rejected by Telegram on every retry.
+    """
+    texts = [truncate(text, limit) for text in texts]
+    count, current = 1, texts[0]
+    for text in texts[1:]:
+        candidate = f"{current}{DIGEST_SEPARATOR}{text}"
+        if len(candidate) > limit:
+            break
+        count, current = count + 1, candidate
+    if count > 1:
+        current = f"🗞 *{count} updates*{DIGEST_SEPARATOR}{current}"
+    return count, current
+
+class OutboxDispatcher:
+    """Delivers the notification_outbox table to Telegram from a background thread.
+
+    Each chat gets at most one message per TELEGRAM_CHAT_INTERVAL; anything
+    that piles up meanwhile is sent as a digest. Failed deliveries are
+    retried with exponential backoff (or after Telegram's retry_after) and
+    dropped after NOTIFY_MAX_ATTEMPTS. Rows are claimed before sending, so
+    several processes (e.g. orchestrator replicas) can each run a dispatcher
+    without delivering anything twice.
+    """
+
+    def __init__(self):
+        self.http = requests.Session()
+        self._wake = threading.Event()
+        self._next_send = {}  # chat_id -> monotonic time it may be sent to again
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, name="notifier", daemon=True).start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            woken = self._wake.wait(NOTIFY_POLL_INTERVAL)
+            if woken:
+                # Let a burst finish arriving so it goes out as one message
+                time.sleep(NOTIFY_COALESCE_WINDOW)
+            self._wake.clear()
+            try:
+                delay = self.dispatch()
+            except Exception as e:
+                logger.error(f"Notification dispatch failed: {e}")
+                continue
+            if delay is not None:
+                # A chat is still rate limited; come back when it frees up
+                threading.Timer(delay, self._wake.set).start()
+
+    def dispatch(self):
+        """Send everything due. Returns seconds until a rate-limited chat frees up, or None."""
+        with self._lock:
+            rows = db.claim_due_notifications(NOTIFY_MAX_ATTEMPTS, NOTIFY_CLAIM_SECONDS)
+            by_chat = {}
+            for row in rows:
+                by_chat.setdefault(row[1], []).append(row)
+
+            wait = None
+            for chat_id, chat_rows in by_chat.items():
+                remaining = self._next_send.get(chat_id, 0) - time.monotonic()
+                if remaining > 0:
+                    wait = remaining if wait is None else min(wait, remaining)
+                    db.release_notifications([row[0] for row in chat_rows])
+                    continue
+                if self._send_chat(chat_id, chat_rows):
+                    wait = TELEGRAM_CHAT_INTERVAL if wait is None else min(wait, TELEGRAM_CHAT_INTERVAL)
+            return wait
+
+    def _send_chat(self, chat_id, rows):
+        """Send one message (a digest if several are queued). Returns True if rows are left for the next interval."""
+        count, text = digest([row[2] for row in rows])
+        ids = [row[0] for row in rows[:count]]
+        self._next_send[chat_id] = time.monotonic() + TELEGRAM_CHAT_INTERVAL
+        try:
+            self._post(chat_id, text)
+        except TelegramError as e:
+            attempts = max(row[3] for row in rows[:count]) + 1
+            delay = e.retry_after or min(NOTIFY_BACKOFF_BASE * 2 ** (attempts - 1), NOTIFY_BACKOFF_MAX)
+            delay += random.uniform(0, delay * 0.1)
+            if e.retry_after:
+                self._next_send[chat_id] = time.monotonic() + e.retry_after
+            level = logging.ERROR if attempts >= NOTIFY_MAX_ATTEMPTS else logging.WARNING
+            logger.log(level, f"Telegram delivery of {count} message(s) failed (attempt {attempts}): {e}")
+            db.reschedule_notifications(ids, datetime.now() + timedelta(seconds=delay), str(e))
+        else:
+            db.mark_notifications_sent(ids)
+        db.release_notifications([row[0] for row in rows[count:]])
+        return len(rows) > count
+
+    def _post(self, chat_id, text):
+        try:
+            post_message(chat_id, text, http=self.http)
+        except TelegramError as e:
+            # A stray Markdown character shouldn't cost the whole message
+            if e.status == 400 and "parse entities" in str(e):
+                post_message(chat_id, text, parse_mode=None, http=self.http)
+            else:
+                raise
+
+def start_dispatcher():
+    """Start delivering the outbox from this process."""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboxDispatcher().start()
+    return _dispatcher
+
+def flush(timeout=30):
+    """Deliver due messages now, waiting out per-chat rate limits for up to `timeout` seconds."""
+    dispatcher = _dispatcher or OutboxDispatcher()
+    deadline = time.monotonic() + timeout
+    while True:
+        delay = dispatcher.dispatch()
+        if delay is None or time.monotonic() + delay > deadline:
+            return
+        time.sleep(delay)
 
 def send_message(text):
-    """Send a simple text message via Telegram."""
+    """Queue a Telegram message; it is delivered by the outbox dispatcher.
+
+    Never blocks on Telegram. Returns False if Telegram isn't configured or
+    the message couldn't be queued.
+    """
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         logger.warning("Telegram notification skipped: Token or Chat ID not set.")
         return False
 
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": text,
-        "parse_mode": "Markdown"
-    }
-    
     try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        return True
+        db.enqueue_notification(TELEGRAM_CHAT_ID, text)
     except Exception as e:
-        logger.error(f"Failed to send Telegram message: {e}")
+        logger.error(f"Failed to queue Telegram message: {e}")
         return False
+    if _dispatcher:
+        _dispatcher.wake()
+    return True
+
+def issue_ref(issue_number, repo=None):
+    """Format an issue reference, qualified with the repo when one is given."""
+    return f"{repo}#{issue_number}" if repo else f"#{issue_number}"
 
-def notify_session_started(issue_number, title):
-    msg = f"🚀 *Session Started*\n\nIssue #{issue_number}: {title}\nJules is now working on this feature."
+def notify_session_started(issue_number, title, repo=None):
+    msg = f"🚀 *Session Started*\n\nIssue {issue_ref(issue_number, repo)}: {title}\nJules is now working on this feature."
     send_message(msg)
 
-def notify_pr_created(issue_number, pr_url):
-    msg = f"📦 *PR Created*\n\nPR for Issue #{issue_number} is ready for review:\n{pr_url}"
+def notify_pr_created(issue_number, pr_url, repo=None):
+    msg = f"📦 *PR Created*\n\nPR for Issue {issue_ref(issue_number, repo)} is ready for review:\n{pr_url}"
     send_message(msg)
 
-def notify_merged(issue_number, pr_number):
-    msg = f"✅ *Merged*\n\nPR #{pr_number} for Issue #{issue_number} has been successfully merged!"
+def notify_merged(issue_number, pr_number, repo=None):
+    msg = f"✅ *Merged*\n\nPR #{pr_number} for Issue {issue_ref(issue_number, repo)} has been successfully merged!"
     send_message(msg)
 
-def notify_pr_ready_for_review(issue_number, pr_url):
-    msg = f"👀 *Ready for Review*\n\nJules has finished work on Issue #{issue_number}.\nPlease review and merge the PR manually:\n{pr_url}"
+def notify_pr_ready_for_review(issue_number, pr_url, repo=None):
+    msg = f"👀 *Ready for Review*\n\nJules has finished work on Issue {issue_ref(issue_number, repo)}.\nPlease review and merge the PR manually:\n{pr_url}"
     send_message(msg)
 
-def notify_failed(issue_number, session_id):
-    msg = f"❌ *Session Failed*\n\nSession {session_id} for Issue #{issue_number} has failed.\nOrchestrator has been PAUSED."
+def notify_failed(issue_number, session_id, repo=None):
+    msg = f"❌ *Session Failed*\n\nSession {session_id} for Issue {issue_ref(issue_number, repo)} has failed.\nOrchestrator has been PAUSED."
     send_message(msg)
 
-def notify_merge_failed(issue_number, pr_number):
-    msg = f"🚨 *Merge Failed*\n\nAuto-merge failed for PR #{pr_number} (Issue #{issue_number}).\nOrchestrator has been PAUSED. Please check logs and resolve manually."
-    send_message(msg)
\ No newline at end of file
+def notify_closed(issue_number, reason, repo=None):
+    msg = f"🗑 *Session Closed*\n\nWork on Issue {issue_ref(issue_number, repo)} has stopped: {reason}.\nUse `/pick` to start it again."
+    send_message(msg)
+
+def notify_merge_failed(issue_number, pr_number, repo=None):
+    msg = f"🚨 *Merge Failed*\n\nAuto-merge failed for PR #{pr_number} (Issue {issue_ref(issue_number, repo)}).\nOrchestrator has been PAUSED. Please check logs and resolve manually."
+    send_message(msg)
@@ -1,12 +1,22 @@
 import os
-import subprocess
+import re
 import json
 import time
+import random
+import socket
 import logging
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
 from dotenv import load_dotenv
 import db
+from config import TARGET_REPOS
+import metrics
 import notifier
+import webhook_server
+from session_index import JulesSessionIndex, session_id_of
+from github_client import GitHubError, get_client as get_github, pull_from_api
+from jules_client import JulesError, CircuitOpenError, get_client as get_jules
 
 # Setup logging
 logging.basicConfig(
@@ -17,177 +27,236 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-# Alias GITHUB_TOKEN to GH_TOKEN for the gh CLI if necessary
-if os.getenv("GITHUB_TOKEN") and not os.getenv("GH_TOKEN"):
-    os.environ["GH_TOKEN"] = os.getenv("GITHUB_TOKEN")
-
-TARGET_REPO = os.getenv("TARGET_REPO")
 ISSUE_LABEL = os.getenv("ISSUE_LABEL", "jules-task")
 MANUAL_MODE = os.getenv("MANUAL_MODE", "false").lower() == "true"
 YOLO_MODE = os.getenv("YOLO_MODE", "false").lower() == "true"
 SLEEP_INTERVAL = int(os.getenv("SLEEP_INTERVAL", "300"))
-JULES_API_KEY = os.getenv("JULES_API_KEY")
-
-JULES_API_BASE = "https://jules.googleapis.com/v1alpha"
-
-# Track retries for merging COMPLETED sessions
-merge_retries = {}
-
-def run_command(command, cwd=None):
-    """Run a shell command and return the output."""
-    try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            check=True,
-            capture_output=True,
-            text=True,
-            cwd=cwd
-        )
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Command failed: {command}\nError: {e.stderr}")
-        return None
-
-def fetch_open_issues():
+# Jules sessions that may run at once; sessions waiting on PR review don't count
+MAX_CONCURRENT_SESSIONS = int(os.getenv("MAX_CONCURRENT_SESSIONS", "1"))
+REVIEW_POLL_INTERVAL = int(os.getenv("REVIEW_POLL_INTERVAL", "60"))
+# PRs pulled into the local index the first time a repo is synced
+PR_INDEX_BACKFILL = int(os.getenv("PR_INDEX_BACKFILL", "200"))
+PR_SYNC_MIN_INTERVAL = int(os.getenv("PR_SYNC_MIN_INTERVAL", "10"))
+def parse_intervals(spec):
+    """Parse "STATE=seconds,..." into a dict; `default` covers unlisted states."""
+    intervals = {}
+    for part in spec.split(","):
+        if "=" in part:
+            state, seconds = part.split("=", 1)
+            intervals[state.strip()] = float(seconds)
+    return intervals
+
+# Seconds between status polls per Jules session state
+JULES_POLL_INTERVALS = parse_intervals(os.getenv(
+    "JULES_POLL_INTERVALS",
+    "QUEUED=15,PLANNING=30,AWAITING_PLAN_APPROVAL=60,AWAITING_USER_FEEDBACK=120,IN_PROGRESS=90,default=60"
+))
+# Polls that see no change stretch the interval by 1.5x each, up to this multiple
+JULES_POLL_STRETCH_MAX = float(os.getenv("JULES_POLL_STRETCH_MAX", "4"))
+JULES_POLL_BACKOFF_BASE = float(os.getenv("JULES_POLL_BACKOFF_BASE", "15"))
+JULES_POLL_BACKOFF_MAX = float(os.getenv("JULES_POLL_BACKOFF_MAX", "600"))
+# How long a resolved Jules source / default branch is reused
+JULES_SOURCES_TTL = float(os.getenv("JULES_SOURCES_TTL", "3600"))
+# Identifies this replica's leases in the work queue; must be unique per running orchestrator
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+# A lease not renewed for this long is considered abandoned and handed to another replica
+WORK_LEASE_SECONDS = float(os.getenv("WORK_LEASE_SECONDS", "120"))
+
+# Status polls each session being driven has needed so far, keyed by session id;
+# entries are dropped once the session stops being polled
+session_polls = {}
+
+# Futures of sessions currently driven by a worker, keyed by (repo, issue number)
+running = {}
+# Keys in `running` whose lease was taken over by another replica; their workers stop
+lost_leases = set()
+# Offset into TARGET_REPOS for round-robin issue selection
+_rotation = 0
+
+# Set by webhooks and finishing workers to cut the main loop's sleep short
+wake_event = threading.Event()
+# Notified on pause/resume so paused workers continue as soon as they're resumed
+pause_changed = threading.Condition()
+
+# One Jules source cache shared by every repo
+_sources = {}  # repo -> {"source", "branch", "fetched_at"}
+_sources_lock = threading.Lock()
+
+# Monotonic time of the last PR index sync per repo
+_pr_synced_at = {}
+_pr_sync_lock = threading.Lock()
+
+def fetch_open_issues(repo):
     """Fetch all open issues with the target label."""
-    query = f'gh issue list --repo {TARGET_REPO} --label "{ISSUE_LABEL}" --json number,title,body'
-    output = run_command(query)
-    if not output:
+    try:
+        return get_github().list_issues(repo, labels=ISSUE_LABEL)
+    except GitHubError as e:
+        logger.error(f"Failed to list issues for {repo}: {e}")
         return []
-    return json.loads(output)
 
-def fetch_next_issue():
-    """Fetch the next issue based on user selection via Telegram."""
-    logger.info("Checking for next task...")
+def parse_issue_ref(value):
+    """Split an `owner/repo#number` reference; bare numbers refer to the first repo."""
+    repo, _, number = str(value).rpartition('#')
+    return (repo or TARGET_REPOS[0]), number
+
+def fetch_next_issue(repo, exclude=()):
+    """Fetch the next issue based on user selection via Telegram.
+
+    Issues whose numbers are in `exclude` (e.g. already handed to a worker) are skipped.
+    """
+    logger.info(f"Checking for next task in {repo}...")
+    waiting_key = f"waiting_for_input:{repo}"
     
     # 1. Check if user selected an issue
-    selected_id = db.get_setting('next_issue')
-    if selected_id:
-        logger.info(f"User selected issue #{selected_id}")
-        db.delete_setting('next_issue')
-        db.delete_setting('waiting_for_input')
+    selected = db.get_setting('next_issue')
+    selected_repo, selected_id = parse_issue_ref(selected) if selected else (None, None)
+    # Popping is atomic, so only one replica acts on a /pick
+    if selected_repo == repo and db.pop_setting('next_issue') == selected:
+        logger.info(f"User selected issue {repo}#{selected_id}")
+        db.delete_setting(waiting_key)
         
-        cmd = f'gh issue view {selected_id} --repo {TARGET_REPO} --json number,title,body'
-        out = run_command(cmd)
-        if out:
-            return json.loads(out)
-        else:
-            logger.error(f"Selected issue #{selected_id} not found.")
+        try:
+            return get_github().get_issue(repo, selected_id)
+        except GitHubError as e:
+            logger.error(f"Selected issue #{selected_id} not found: {e}")
             return None
 
     # 2. Check if we are already waiting for input
-    if not YOLO_MODE and db.get_setting('waiting_for_input') == 'true':
+    if not YOLO_MODE and db.get_setting(waiting_key) == 'true':
         logger.info("Waiting for user selection...")
         return None
 
     # 3. Fetch open issues and prompt user
-    issues = fetch_open_issues()
+    issues = fetch_open_issues(repo)
     if not issues:
-        logger.info("No open issues found in backlog.")
+        logger.info(f"No open issues found in {repo} backlog.")
+        metrics.BACKLOG_DEPTH.set(0, repo=repo)
         return None
     
     valid_issues = []
     for issue in issues:
+        if issue['number'] in exclude:
+            continue
         # Check if issue is already in progress
-        sess = db.get_session_by_issue(issue['number'], TARGET_REPO)
+        sess = db.get_session_by_issue(issue['number'], repo)
         if not sess:
             valid_issues.append(issue)
+    metrics.BACKLOG_DEPTH.set(len(valid_issues), repo=repo)
             
     if not valid_issues:
-        logger.info("All open issues are already processed or in progress.")
+        logger.info(f"All open issues in {repo} are already processed or in progress.")
         return None
 
     if YOLO_MODE:
         issue = valid_issues[0]
-        logger.info(f"YOLO MODE: Auto-selecting Issue #{issue['number']} - {issue['title']}")
+        logger.info(f"YOLO MODE: Auto-selecting Issue {repo}#{issue['number']} - {issue['title']}")
         return issue
 
     # Construct prompt message
-    msg = "📋 *Select Next Task*\n\n"
+    msg = f"📋 *Select Next Task* ({repo})\n\n"
     for i in valid_issues[:10]:
         msg += f"• *#{i['number']}*: {i['title']}\n"
-    msg += "\nReply with `/pick <number>` to start."
+    if repo == TARGET_REPOS[0]:
+        msg += "\nReply with `/pick <number>` to start."
+    else:
+        msg += f"\nReply with `/pick {repo}#<number>` to start."
     
     notifier.send_message(msg)
-    db.set_setting('waiting_for_input', 'true')
+    db.set_setting(waiting_key, 'true')
     return None
 
-def get_repo_info():
-    """Get the source name and default branch for the target repo."""
-    headers = {"x-goog-api-key": JULES_API_KEY}
+def get_repo_info(repo):
+    """Get the source name and default branch for a repo.
+
+    Resolutions are cached in memory and in the settings table for
+    JULES_SOURCES_TTL. A miss lists the sources once and caches every
+    configured repo found, so repos share a single lookup.
+    """
+    key = f"jules_source:{repo}"
     try:
-        response = requests.get(f"{JULES_API_BASE}/sources", headers=headers)
-        response.raise_for_status()
-        sources = response.json().get('sources', [])
+        with _sources_lock:
+            entry = _sources.get(repo)
+            if not entry or time.time() - entry['fetched_at'] > JULES_SOURCES_TTL:
+                stored = db.get_setting(key)
+                entry = json.loads(stored) if stored else None
+            if not entry or time.time() - entry['fetched_at'] > JULES_SOURCES_TTL:
+                fetched_at = time.time()
+                for src in get_jules().list_sources():
+                    gr = src.get('githubRepo', {})
+                    full_name = f"{gr.get('owner')}/{gr.get('repo')}"
+                    if full_name in TARGET_REPOS:
+                        resolved = {
+                            "source": src['name'],
+                            "branch": gr.get('defaultBranch', {}).get('displayName', 'main'),
+                            "fetched_at": fetched_at,
+                        }
+                        _sources[full_name] = resolved
+                        db.set_setting(f"jules_source:{full_name}", json.dumps(resolved))
+                entry = _sources.get(repo)
+            else:
+                _sources[repo] = entry
+
+        if entry:
+            return entry['source'], entry['branch']
         
-        owner, repo = TARGET_REPO.split('/')
-        for src in sources:
-            gr = src.get('githubRepo', {})
-            if gr.get('owner') == owner and gr.get('repo') == repo:
-                source_name = src['name']
-                default_branch = gr.get('defaultBranch', {}).get('displayName', 'main')
-                return source_name, default_branch
-        
-        logger.error(f"Source for {TARGET_REPO} not found in Jules.")
+        logger.error(f"Source for {repo} not found in Jules.")
         return None, None
     except Exception as e:
         logger.error(f"Failed to fetch sources: {e}")
         return None, None
 
-def find_existing_session(title):
-    """Check if there's an existing session for this issue on Jules API."""
-    headers = {"x-goog-api-key": JULES_API_KEY}
-    try:
-        response = requests.get(f"{JULES_API_BASE}/sessions?pageSize=20", headers=headers)
-        response.raise_for_status()
-        sessions = response.json().get('sessions', [])
-        for s in sessions:
-            if s.get('title') == title and s.get('state') not in ["COMPLETED", "FAILED"]:
-                sid = s.get('id') or s.get('name').split('/')[-1]
-                return sid
-        return None
-    except Exception as e:
-        logger.error(f"Failed to check existing sessions: {e}")
-        return None
+def invalidate_repo_info(repo):
+    """Forget the cached source for a repo so the next lookup lists sources again."""
+    with _sources_lock:
+        _sources.pop(repo, None)
+        db.delete_setting(f"jules_source:{repo}")
+
+session_index = JulesSessionIndex(lambda page_token: get_jules().list_sessions(page_token))
 
-def run_jules_api_session(issue, session_id=None):
-    """Invoke Jules via REST API and poll for completion."""
+def find_existing_session(source_name, title):
+    """Check if there's an existing non-terminal Jules session for this issue."""
+    return session_index.find(source_name, title=title)
+
+def run_jules_api_session(repo, issue, session_id=None, reclaimed=False):
+    """Invoke Jules via REST API and poll for completion.
+
+    `reclaimed` marks work taken over from a dead worker, which may have
+    created a session shortly before it died; the session index is then
+    refreshed from Jules before deciding to create one.
+    """
     issue_number = issue['number']
     issue_title = issue['title']
     session_title = f"Fix Issue #{issue_number}"
     
     # Check for existing session in DB first if not provided
     if not session_id:
-        existing_db_sess = db.get_session_by_issue(issue_number, TARGET_REPO)
-        if existing_db_sess and existing_db_sess[4] not in ["MERGED", "FAILED"]:
+        existing_db_sess = db.get_session_by_issue(issue_number, repo)
+        if existing_db_sess and existing_db_sess[4] not in ["MERGED", "FAILED", "CLOSED"]:
             session_id = existing_db_sess[0]
-            logger.info(f"Resuming session {session_id} from DB for Issue #{issue_number}")
+            logger.info(f"Resuming session {session_id} from DB for Issue {repo}#{issue_number}")
     else:
-         logger.info(f"Resuming specific session {session_id} for Issue #{issue_number}")
+         logger.info(f"Resuming specific session {session_id} for Issue {repo}#{issue_number}")
 
     if not session_id:
-        # Check Jules API for any non-terminal session with this title
-        existing_id = find_existing_session(session_title)
+        source_name, default_branch = get_repo_info(repo)
+        if not source_name:
+            return None
+
+        # Check Jules for any non-terminal session with this title
+        if reclaimed:
+            session_index.refresh(force=True)
+        existing_id = find_existing_session(source_name, session_title)
         if existing_id:
             logger.info(f"Found active Jules session {existing_id} for {session_title}. Resuming.")
             session_id = existing_id
+            db.set_work_session(repo, issue_number, session_id)
         else:
-            source_name, default_branch = get_repo_info()
-            if not source_name:
-                return None
-
             # Allow overriding the base branch via environment variable
             starting_branch = os.getenv("BASE_BRANCH") or default_branch
             logger.info(f"Using starting branch: {starting_branch}")
 
-            logger.info(f"Starting NEW Jules API session for Issue #{issue_number}")
-            notifier.notify_session_started(issue_number, issue_title)
-            
-            headers = {
-                "x-goog-api-key": JULES_API_KEY,
-                "Content-Type": "application/json"
-            }
+            logger.info(f"Starting NEW Jules API session for Issue {repo}#{issue_number}")
+            notifier.notify_session_started(issue_number, issue_title, repo=repo)
             
             payload = {
                 "prompt": f"Fix Issue #{issue_number}: {issue_title}\n\n{issue.get('body', '')}",
@@ -202,199 +271,505 @@ def run_jules_api_session(issue, session_id=None):
             }
             
             try:
-                response = requests.post(f"{JULES_API_BASE}/sessions", headers=headers, json=payload)
-                response.raise_for_status()
-                session = response.json()
-                session_id = session['id']
-                logger.info(f"Session {session_id} created. Polling...")
-            except Exception as e:
+                session = get_jules().create_session(payload)
+                session_id = session_id_of(session)
+            except JulesError as e:
                 logger.error(f"API Request failed: {e}")
+                # A stale source (repo renamed, reconnected, or removed) fails creation;
+                # drop it so the next attempt resolves the source afresh
+                if e.status in (400, 403, 404) and "source" in e.body.lower():
+                    logger.warning(f"Invalidating cached Jules source for {repo}.")
+                    invalidate_repo_info(repo)
                 return None
 
-    # Track in DB
-    db.save_session(session_id, issue_number, issue_title, TARGET_REPO, "IN_PROGRESS")
+            # Record the session before anything else can fail, so a worker that
+            # reclaims this item resumes it instead of creating a second one
+            db.save_session(session_id, issue_number, issue_title, repo, "IN_PROGRESS")
+            db.set_work_session(repo, issue_number, session_id)
+            logger.info(f"Session {session_id} created. Polling...")
+            try:
+                session_index.add(session)
+            except Exception as e:
+                logger.warning(f"Could not index session {session_id}: {e}")
+
+    # Track in DB; a resumed session keeps its recorded state so the event log
+    # doesn't show a spurious transition back to IN_PROGRESS
+    existing = db.get_session(session_id)
+    if existing:
+        last_state = existing[4]
+    else:
+        db.save_session(session_id, issue_number, issue_title, repo, "IN_PROGRESS")
+        last_state = "IN_PROGRESS"
 
     # Common Polling Logic
-    headers = {"x-goog-api-key": JULES_API_KEY}
+    unchanged, failures = 0, 0
+    session_polls[session_id] = 0
     while True:
+        if (repo, issue_number) in lost_leases:
+            logger.warning(f"Lease on Issue {repo}#{issue_number} was taken over; leaving session {session_id} to its new worker.")
+            session_polls.pop(session_id, None)
+            return None
+
         # Check if we should pause while polling
         if db.is_paused():
-            logger.info("Orchestrator paused. Waiting 30s...")
-            time.sleep(30)
+            logger.info("Orchestrator paused. Waiting for resume...")
+            with pause_changed:
+                # The timeout only covers a missed notification
+                pause_changed.wait_for(lambda: not db.is_paused(), timeout=30)
             continue
 
         try:
-            status_res = requests.get(f"{JULES_API_BASE}/sessions/{session_id}", headers=headers)
-            status_res.raise_for_status()
-            session_data = status_res.json()
+            session_polls[session_id] += 1
+            session_data = get_jules().get_session(session_id)
             state = session_data.get('state')
-            
-            logger.info(f"Session {session_id} state: {state}")
-            db.update_session_state(session_id, state)
-            
-            if state == "COMPLETED":
-                logger.info(f"Session {session_id} completed!")
-                return session_data
-            elif state == "FAILED":
-                logger.error(f"Session {session_id} failed.")
-                db.update_session_state(session_id, "FAILED")
-                notifier.notify_failed(issue_number, session_id)
-                db.set_paused(True)
-                return None
-                
-            time.sleep(60)
+            failures = 0
+            metrics.JULES_POLLS.inc(state=state)
         except Exception as e:
-            logger.error(f"Polling failed: {e}")
-            time.sleep(30)
+            failures += 1
+            delay = backoff_delay(failures)
+            if isinstance(e, CircuitOpenError):
+                delay = max(delay, e.retry_in)
+            logger.error(f"Polling failed ({failures} in a row): {e}. Retrying in {delay:.0f}s")
+            time.sleep(delay)
+            continue
+
+        # Only real transitions cost a DB write
+        if state != last_state:
+            logger.info(f"Session {session_id} state: {last_state} -> {state}")
+            db.update_session_state(session_id, state)
+            session_index.update_state(session_id, state)
+            last_state, unchanged = state, 0
+        else:
+            unchanged += 1
+
+        if state == "COMPLETED":
+            polls = session_polls.pop(session_id)
+            logger.info(f"Session {session_id} completed after {polls} polls!")
+            metrics.SESSION_POLLS.observe(polls, outcome="completed")
+            return session_data
+        elif state == "FAILED":
+            polls = session_polls.pop(session_id)
+            logger.error(f"Session {session_id} failed after {polls} polls.")
+            metrics.SESSION_POLLS.observe(polls, outcome="failed")
+            notifier.notify_failed(issue_number, session_id, repo=repo)
+            db.set_paused(True)
+            return None
+
+        time.sleep(poll_delay(state, unchanged))
+
+def poll_delay(state, unchanged):
+    """Seconds until the next status poll, stretched while the state stays the same."""
+    interval = JULES_POLL_INTERVALS.get(state, JULES_POLL_INTERVALS.get("default", 60))
+    return interval * min(1.5 ** unchanged, JULES_POLL_STRETCH_MAX)
+
+def backoff_delay(failures):
+    """Exponential backoff with jitter: half the capped delay is fixed, half random."""
+    delay = min(JULES_POLL_BACKOFF_MAX, JULES_POLL_BACKOFF_BASE * 2 ** (failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def match_pull_request(pr, sessions):
+    """Work out which session and issue a PR belongs to.
+
+    A session id in the branch name wins; otherwise the issue is taken from
+    `#N` in the title or `issue-N` in the branch and linked to that issue's
+    active session. Returns (session_id, issue_number), either may be None.
+    """
+    branch = pr['headRefName'].lower()
+    for session_id, issue_number in sessions:
+        if str(session_id).lower() in branch:
+            return session_id, issue_number
+
+    match = re.search(r"#(\d+)\b", pr['title']) or re.search(r"issue-(\d+)\b", branch)
+    if not match:
+        return None, None
+    issue_number = int(match.group(1))
+    for session_id, active_issue in sessions:
+        if active_issue == issue_number:
+            return session_id, issue_number
+    return None, issue_number
+
+def sync_pull_requests(repo):
+    """Bring the local PR index up to date with PRs changed since the last sync.
+
+    PRs are read newest-updated first and reading stops at the stored cursor,
+    so a quiet repo costs one (usually 304) request.
+    """
+    with _pr_sync_lock:
+        last = _pr_synced_at.get(repo)
+        if last and time.monotonic() - last < PR_SYNC_MIN_INTERVAL:
+            return
+        cursor_key = f"pr_sync_cursor:{repo}"
+        cursor = db.get_setting(cursor_key)
+        sessions = [(sess[0], sess[1]) for sess in db.get_active_sessions(repo)]
+
+        rows, newest = [], None
+        limit = None if cursor else PR_INDEX_BACKFILL
+        try:
+            for pr in get_github().iter_pulls(repo, state="all", sort="updated", limit=limit):
+                updated = pr['updatedAt']
+                if cursor and updated < cursor:
+                    break
+                newest = max(newest or updated, updated)
+                session_id, issue_number = match_pull_request(pr, sessions)
+                rows.append((
+                    repo, pr['number'], session_id, issue_number, pr['title'], pr['headRefName'],
+                    pr['url'], pr['state'], datetime.fromisoformat(updated.replace("Z", "+00:00")),
+                ))
+        except GitHubError as e:
+            logger.error(f"Failed to sync PRs for {repo}: {e}")
+            return
+
+        db.upsert_pull_requests(rows)
+        if newest and newest != cursor:
+            db.set_setting(cursor_key, newest)
+        _pr_synced_at[repo] = time.monotonic()
+        if rows:
+            logger.info(f"Indexed {len(rows)} updated PR(s) for {repo}")
+
+def refresh_pull_states(repo, pr_numbers):
+    """Refresh state, mergeability and checks of tracked PRs with batched GraphQL queries."""
+    if not pr_numbers:
+        return
+    try:
+        states = get_github().get_pull_states(repo, pr_numbers)
+    except GitHubError as e:
+        logger.error(f"Failed to refresh PR states for {repo}: {e}")
+        return
+    db.update_pull_states(repo, [
+        (number, st['state'], st['url'], st['mergeable'], st['checks']) for number, st in states.items()
+    ])
+
+def check_pr_status(repo, issue_number, session_data=None, notify=False, sync=True):
+    """Check if the PR for the issue has been manually merged (or closed without merging).
+
+    Returns True once the session is finished with. With `sync` off the PR
+    index is trusted as-is, e.g. right after a batch refresh.
+    """
+    logger.info(f"Checking PR status for Issue {repo}#{issue_number}...")
 
-def check_pr_status(issue_number, session_data=None, notify=False):
-    """Check if the PR for the issue has been manually merged."""
-    logger.info(f"Checking PR status for Issue #{issue_number}...")
-    
-    # Use --state all and --limit to find recent PRs (merged or open)
-    # Search by issue number is unreliable if title doesn't contain it.
-    find_pr_cmd = f'gh pr list --repo {TARGET_REPO} --state all --limit 50 --json number,url,title,headRefName,state'
-    pr_output = run_command(find_pr_cmd)
-    
-    if not pr_output:
-        return False
-        
-    prs = json.loads(pr_output)
-    target_pr = None
-    
     session_id = None
     if isinstance(session_data, dict):
         session_id = session_data.get('id')
     elif isinstance(session_data, str):
         session_id = session_data
 
-    for pr in prs:
-        title = pr['title'].lower()
-        branch = pr['headRefName'].lower()
-        issue_ref = f"#{issue_number}"
-        
-        if session_id and str(session_id) in branch:
-            target_pr = pr
-            break
-            
-        if issue_ref in title or f"issue-{issue_number}" in branch or "jules" in branch:
-            target_pr = pr
-            break
-            
-    if not target_pr:
-        logger.warning(f"No PR found for Issue #{issue_number}")
+    if sync:
+        sync_pull_requests(repo)
+    found = db.find_pull_request(repo, session_id, issue_number)
+    if not found:
+        logger.warning(f"No PR found for Issue {repo}#{issue_number}")
         return False
-        
-    pr_number = target_pr['number']
-    pr_url = target_pr['url']
-    
+
+    pr_number, pr_url, state, linked_session, session_pr_number, mergeable, checks = found
+    if session_id and linked_session != session_id:
+        db.link_pull_request(repo, pr_number, session_id)
     # Notify if first time seeing PR
-    if session_id:
+    if session_id and session_pr_number != pr_number:
         db.update_session_pr(session_id, pr_number, pr_url)
 
-    view_cmd = f'gh pr view {pr_number} --repo {TARGET_REPO} --json state,url'
-    view_out = run_command(view_cmd)
-    if view_out:
-        pr_details = json.loads(view_out)
-        state = pr_details['state'] # OPEN, MERGED, CLOSED
+    github = get_github()
+    if state == "MERGED":
+        return finalize_merged(repo, issue_number, pr_number, session_id)
+
+    elif state == "CLOSED":
+        logger.info(f"PR #{pr_number} was closed without merging.")
+        close_session(repo, issue_number, session_id, f"PR #{pr_number} was closed without merging")
+        return True
         
-        if state == "MERGED":
-            logger.info(f"PR #{pr_number} is MERGED.")
-            notifier.notify_merged(issue_number, pr_number)
-            
-            if session_id:
-                db.update_session_state(session_id, "MERGED")
-            
-            close_issue_cmd = f'gh issue close {issue_number} --repo {TARGET_REPO} --comment "Merged via automation in PR #{pr_number}"'
-            run_command(close_issue_cmd)
-            return True
-            
-        elif state == "OPEN":
-            logger.info(f"PR #{pr_number} is OPEN. Waiting for manual merge.")
-            
-            if YOLO_MODE:
-                logger.info(f"YOLO MODE: Attempting to auto-merge PR #{pr_number}...")
-                merge_cmd = f'gh pr merge {pr_number} --repo {TARGET_REPO} --merge --delete-branch'
-                merge_out = run_command(merge_cmd)
-                if merge_out is not None:
-                     logger.info(f"YOLO MODE: Merge command sent for PR #{pr_number}.")
-                else:
-                     logger.error(f"YOLO MODE: Failed to merge PR #{pr_number}.")
-                     notifier.notify_merge_failed(issue_number, pr_number)
-                     db.set_paused(True)
+    elif state == "OPEN":
+        logger.info(f"PR #{pr_number} is OPEN (mergeable: {mergeable}, checks: {checks}). Waiting for manual merge.")
+        
+        if YOLO_MODE:
+            logger.info(f"YOLO MODE: Attempting to auto-merge PR #{pr_number}...")
+            try:
+                github.merge_pull(repo, pr_number, method="merge", delete_branch=True)
+                logger.info(f"YOLO MODE: Merge request sent for PR #{pr_number}.")
+            except GitHubError as e:
+                # Someone (or another replica) may have merged it first; that's not a failure
+                refresh_pull_states(repo, [pr_number])
+                found = db.find_pull_request(repo, session_id, issue_number)
+                if found and found[0] == pr_number and found[2] == "MERGED":
+                    return finalize_merged(repo, issue_number, pr_number, session_id)
+                logger.error(f"YOLO MODE: Failed to merge PR #{pr_number}: {e}")
+                notifier.notify_merge_failed(issue_number, pr_number, repo=repo)
+                db.set_paused(True)
 
-            if notify:
-                notifier.notify_pr_ready_for_review(issue_number, pr_url)
-            return False
+        if notify:
+            notifier.notify_pr_ready_for_review(issue_number, pr_url, repo=repo)
+        return False
 
     return False
 
-def process_one_active_session():
-    """Resume and finish ONE active session if exists. Returns True if work was done."""
-    active = db.get_active_sessions(TARGET_REPO)
-    if not active:
-        return False
-        
-    sess = active[0]
-    session_id, issue_number, title, repo, state = sess[0], sess[1], sess[2], sess[3], sess[4]
-    
-    if state == "COMPLETED":
-        logger.info(f"Session {session_id} (Issue #{issue_number}) is COMPLETED. Waiting for manual merge...")
-        if check_pr_status(issue_number, session_id):
-            logger.info(f"Session {session_id} manually merged and finalized.")
-            return True
-        else:
-            # PR is still open. We block here. 
-            # We return True to indicate "work is pending" (waiting), 
-            # so the main loop doesn't sleep for full interval or pick new tasks.
-            # But we should sleep a bit to avoid hot-looping the API.
-            logger.info("PR not yet merged. Sleeping 60s...")
-            time.sleep(60)
-            return True
-
-    logger.info(f"Resuming active session: {session_id} (Issue #{issue_number}, State: {state})")
-    session_data = run_jules_api_session({'number': issue_number, 'title': title}, session_id=session_id)
-    if session_data:
-        logger.info("Waiting 20s for PR propagation...")
-        time.sleep(20)
-        check_pr_status(issue_number, session_data, notify=True)
-    
+def finalize_merged(repo, issue_number, pr_number, session_id):
+    """Record a merged PR, announce it and close its issue. Returns True."""
+    logger.info(f"PR #{pr_number} is MERGED.")
+    if session_id and not db.update_session_state(session_id, "MERGED"):
+        # Another replica already finalized it
+        return True
+    notifier.notify_merged(issue_number, pr_number, repo=repo)
+
+    try:
+        get_github().close_issue(repo, issue_number, comment=f"Merged via automation in PR #{pr_number}")
+    except GitHubError as e:
+        logger.error(f"Failed to close Issue {repo}#{issue_number}: {e}")
     return True
 
-def main():
-    if not TARGET_REPO:
-        logger.error("TARGET_REPO not set in environment.")
-        return
+def close_session(repo, issue_number, session_id, reason):
+    """Stop work on an issue whose PR or issue was closed: drop its queued item and mark the session CLOSED."""
+    if db.drop_work(repo, issue_number):
+        logger.info(f"Dropped queued work for Issue {repo}#{issue_number}.")
+    if session_id and db.update_session_state(session_id, "CLOSED"):
+        logger.info(f"Session {session_id} (Issue {repo}#{issue_number}) closed: {reason}")
+        notifier.notify_closed(issue_number, reason, repo=repo)
 
-    db.init_db()
-    single_run = os.getenv("SINGLE_RUN", "false").lower() == "true"
-    logger.info(f"Starting Octo-Jules for {TARGET_REPO} (single_run={single_run})")
-    
+def run_session_worker(repo, issue, session_id=None, reclaimed=False):
+    """Worker entry point: drive one leased session to completion and look up its PR.
+
+    The lease is released by reap_finished_sessions once the worker is done.
+    """
+    key = (repo, issue['number'])
+    if session_id:
+        # The queue row may predate another replica finishing this session
+        sess = db.get_session(session_id)
+        if sess and sess[4] in ("COMPLETED", "MERGED", "FAILED", "CLOSED"):
+            logger.info(f"Session {session_id} is already {sess[4]}; nothing to resume.")
+            return None
+    session_data = run_jules_api_session(repo, issue, session_id=session_id, reclaimed=reclaimed)
+    if session_data and key not in lost_leases:
+        logger.info(f"Waiting 20s for PR propagation (Issue {repo}#{issue['number']})...")
+        time.sleep(20)
+        check_pr_status(repo, issue['number'], session_data, notify=True)
+    return session_data
+
+def submit_session(executor, repo, issue, session_id=None, reclaimed=False):
+    """Hand a session to a worker; the main loop is woken when it finishes."""
+    future = executor.submit(run_session_worker, repo, issue, session_id, reclaimed)
+    future.add_done_callback(lambda _: wake_event.set())
+    running[(repo, issue['number'])] = future
+
+def lease_sessions(executor):
+    """Lease queued work up to this replica's free capacity and start it. Returns how many were started."""
+    capacity = MAX_CONCURRENT_SESSIONS - len(running)
+    if capacity <= 0:
+        return 0
+    leased = db.lease_work(WORKER_ID, capacity, WORK_LEASE_SECONDS)
+    started = 0
+    for repo, issue_number, title, body, session_id, previous in leased:
+        if (repo, issue_number) in running:
+            # Our own lease lapsed (late heartbeat) and we just took it back; the worker is still going
+            logger.warning(f"Re-acquired lapsed lease on Issue {repo}#{issue_number}; keeping the running worker.")
+            continue
+        reclaimed = bool(previous and previous != WORKER_ID)
+        if reclaimed:
+            logger.warning(f"Reclaimed Issue {repo}#{issue_number} from unresponsive worker {previous}")
+        issue = {'number': issue_number, 'title': title, 'body': body or ''}
+        submit_session(executor, repo, issue, session_id, reclaimed=reclaimed)
+        started += 1
+    return started
+
+def renew_leases():
+    """Heartbeat: extend the leases of every session this replica is driving."""
+    keys = [key for key, future in list(running.items()) if not future.done()]
+    held = db.renew_leases(WORKER_ID, keys, WORK_LEASE_SECONDS)
+    for key in keys:
+        if key not in held and key not in lost_leases:
+            logger.error(f"Lost lease on Issue {key[0]}#{key[1]}; stopping its worker.")
+            lost_leases.add(key)
+
+def heartbeat_loop():
     while True:
-        # CHECK IF PAUSED
-        if db.is_paused():
-            logger.info("Orchestrator is PAUSED via database setting. Sleeping...")
-            time.sleep(60)
+        time.sleep(WORK_LEASE_SECONDS / 3)
+        try:
+            renew_leases()
+        except Exception as e:
+            logger.error(f"Lease heartbeat failed: {e}")
+
+def handle_webhook(event, payload):
+    """Apply a GitHub webhook delivery to the PR index and wake the main loop."""
+    repo = payload.get('repository', {}).get('full_name')
+    if repo not in TARGET_REPOS:
+        return
+
+    if event == "pull_request":
+        pr = pull_from_api(payload['pull_request'])
+        sessions = [(sess[0], sess[1]) for sess in db.get_active_sessions(repo)]
+        session_id, issue_number = match_pull_request(pr, sessions)
+        db.upsert_pull_requests([(
+            repo, pr['number'], session_id, issue_number, pr['title'], pr['headRefName'],
+            pr['url'], pr['state'], datetime.fromisoformat(pr['updatedAt'].replace("Z", "+00:00")),
+        )])
+        # Only writes when the session isn't already linked to this PR
+        if session_id:
+            db.update_session_pr(session_id, pr['number'], pr['url'])
+        logger.info(f"Webhook: PR {repo}#{pr['number']} {payload.get('action')} ({pr['state']})")
+        if session_id and pr['state'] == "CLOSED":
+            close_session(repo, issue_number, session_id, f"PR #{pr['number']} was closed without merging")
+    else:
+        issue_number = payload['issue']['number']
+        logger.info(f"Webhook: Issue {repo}#{issue_number} {payload.get('action')}")
+        if payload.get('action') == "closed":
+            sess = db.get_session_by_issue(issue_number, repo)
+            if sess and sess[4] in ("MERGED", "FAILED", "CLOSED"):
+                sess = None
+            if sess and sess[5]:
+                # Its PR decides: a merge finalizes it, closing the PR closes the session
+                logger.info(f"Issue {repo}#{issue_number} closed; session {sess[0]} follows PR #{sess[5]}.")
+            else:
+                close_session(repo, issue_number, sess[0] if sess else None, "the issue was closed")
+
+    wake_event.set()
+
+def on_setting_change(key, value):
+    """Wake the main loop when a control setting (pause/resume, /pick) changes."""
+    if key in ("paused", "next_issue"):
+        logger.info(f"Control setting changed: {key}={value}")
+        wake_event.set()
+    if key == "paused":
+        with pause_changed:
+            pause_changed.notify_all()
+
+def idle(timeout):
+    """Sleep until `timeout` passes or a webhook / finished worker wakes the loop."""
+    if wake_event.wait(timeout):
+        logger.info("Woken up early.")
+    wake_event.clear()
+
+def reap_finished_sessions():
+    """Drop finished workers from the running set, logging any crash and releasing their leases.
+
+    Releasing here, after the future is done, means the heartbeat (which only
+    renews unfinished workers) can never see a released lease as lost.
+    """
+    for key, future in list(running.items()):
+        if not future.done():
             continue
+        del running[key]
+        lost_leases.discard(key)
+        repo, issue_number = key
+        exc = future.exception()
+        if exc:
+            logger.error(f"Worker for Issue {repo}#{issue_number} crashed: {exc}")
+        try:
+            db.release_work(WORKER_ID, repo, issue_number)
+        except Exception as e:
+            # The lease simply expires and the item is picked up again
+            logger.error(f"Failed to release Issue {repo}#{issue_number}: {e}")
+
+def rotate_repos():
+    """Return the repo list starting one further along on each call."""
+    global _rotation
+    start = _rotation % len(TARGET_REPOS)
+    _rotation += 1
+    return TARGET_REPOS[start:] + TARGET_REPOS[:start]
+
+def schedule_sessions(executor):
+    """Run one scheduling pass over every repo. Returns True if any session is still pending."""
+    reap_finished_sessions()
+
+    awaiting_review = False
+    for repo in TARGET_REPOS:
+        sessions = [sess for sess in db.get_active_sessions(repo) if (repo, sess[1]) not in running]
+
+        # One index sync plus one batched state query covers every PR awaiting review
+        completed = [sess for sess in sessions if sess[4] == "COMPLETED"]
+        if completed:
+            sync_pull_requests(repo)
+            refresh_pull_states(repo, [sess[5] for sess in completed if sess[5]])
+
+        for sess in sessions:
+            session_id, issue_number, title, state = sess[0], sess[1], sess[2], sess[4]
 
-        if process_one_active_session():
-            if single_run: break
+            if state == "COMPLETED":
+                # Lease the review check too, so only one replica merges or announces a PR
+                if not db.lease_item(WORKER_ID, repo, issue_number, title, session_id, WORK_LEASE_SECONDS):
+                    logger.info(f"Session {session_id} (Issue {repo}#{issue_number}) is being checked by another worker.")
+                    awaiting_review = True
+                    continue
+                logger.info(f"Session {session_id} (Issue {repo}#{issue_number}) is COMPLETED. Waiting for manual merge...")
+                try:
+                    merged = check_pr_status(repo, issue_number, session_id, sync=False)
+                finally:
+                    db.release_work(WORKER_ID, repo, issue_number)
+                if merged:
+                    logger.info(f"Session {session_id} finalized.")
+                else:
+                    awaiting_review = True
+            elif db.enqueue_work(repo, issue_number, title, session_id=session_id, priority=1):
+                # Unless a replica already holds it; resumes go ahead of new issues
+                logger.info(f"Queued active session {session_id} for resuming (Issue {repo}#{issue_number}, State: {state})")
+
+    # Fill the remaining capacity with new work while earlier PRs wait for review.
+    # Work goes through the shared queue so replicas never start the same issue;
+    # when it runs dry, top it up with one issue per repo in turn so a deep
+    # backlog can't starve the others.
+    candidates = rotate_repos()
+    while len(running) < MAX_CONCURRENT_SESSIONS:
+        if lease_sessions(executor):
             continue
-        
-        issue = fetch_next_issue()
-        if issue:
-            session_data = run_jules_api_session(issue)
-            if session_data:
-                logger.info("Waiting 20s for PR to propagate...")
-                time.sleep(20)
-                check_pr_status(issue['number'], session_data, notify=True)
-        else:
-            logger.info("Nothing to do.")
-            if single_run: break
-            
-        if single_run: break
-        logger.info(f"Sleeping for {SLEEP_INTERVAL}s...")
-        time.sleep(SLEEP_INTERVAL)
+        queued = False
+        for repo in list(candidates):
+            issue = fetch_next_issue(repo, exclude=db.get_queued_issues(repo))
+            if not issue:
+                candidates.remove(repo)
+                continue
+            queued = db.enqueue_work(repo, issue['number'], issue['title'], issue.get('body')) or queued
+        if not queued:
+            break
+
+    try:
+        db.flush_session_events()
+    except Exception as e:
+        logger.error(f"Failed to write session events: {e}")
+
+    return bool(running) or awaiting_review
+
+def main():
+    if not TARGET_REPOS:
+        logger.error("TARGET_REPOS (or TARGET_REPO) not set in environment.")
+        return
+
+    db.init_db()
+    # Control commands arrive as NOTIFYs instead of being polled for
+    db.start_settings_listener(on_change=on_setting_change)
+    # Telegram delivery happens off the main loop, from the outbox table
+    notifier.start_dispatcher()
+    # Keeps this replica's work-queue leases alive while its sessions run
+    threading.Thread(target=heartbeat_loop, name="lease-heartbeat", daemon=True).start()
+    single_run = os.getenv("SINGLE_RUN", "false").lower() == "true"
+    logger.info(
+        f"Starting Octo-Jules for {', '.join(TARGET_REPOS)} "
+        f"(worker={WORKER_ID}, single_run={single_run}, max_concurrent_sessions={MAX_CONCURRENT_SESSIONS})"
+    )
+
+    # Webhooks make merges visible immediately; polling below remains the fallback
+    if not single_run:
+        webhook_server.start(handle_webhook)
+        metrics.start()
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SESSIONS, thread_name_prefix="session") as executor:
+        while True:
+            # CHECK IF PAUSED
+            if db.is_paused():
+                logger.info("Orchestrator is PAUSED via database setting. Sleeping...")
+                idle(SLEEP_INTERVAL)
+                continue
+
+            with metrics.LOOP_SECONDS.time():
+                pending = schedule_sessions(executor)
+            metrics.RUNNING_SESSIONS.set(len(running))
+
+            if single_run:
+                wait(list(running.values()))
+                reap_finished_sessions()
+                notifier.flush()
+                break
+
+            if running or pending:
+                # Finished workers and webhooks wake the loop so slots are refilled right away
+                idle(REVIEW_POLL_INTERVAL)
+            else:
+                logger.info(f"Nothing to do. Sleeping for {SLEEP_INTERVAL}s...")
+                idle(SLEEP_INTERVAL)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,153 @@
+import os
+import json
+import base64
+import fcntl
+import logging
+import subprocess
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+REPO_CACHE_DIR = os.path.expanduser(os.getenv("REPO_CACHE_DIR", "~/.cache/octo-jules/repos"))
+# Where mirrors fetch from; point at file:// paths for testing
+REPO_CLONE_URL = os.getenv("REPO_CLONE_URL", "https://github.com/{repo}.git")
+GIT_TIMEOUT = float(os.getenv("GIT_TIMEOUT", "300"))
+HEAD_REF = "refs/octo-jules/head"
+
+class GitError(Exception):
+    """Raised when a git command fails."""
+
+def _git_env():
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+    token = os.getenv("GH_TOKEN") or os.getenv("GITHUB_TOKEN")
+    if token:
+        # Passed through the environment so the token never lands in argv or the mirror's config
+        credentials = base64.b64encode(f"x-access-token:{token}".encode()).decode()
+        env.update({
+            "GIT_CONFIG_COUNT": "1",
+            "GIT_CONFIG_KEY_0": "http.https://github.com/.extraheader",
+            "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}",
+        })
+    return env
+
+def git(path, *args, input=None, text=True):
+    """Run a git command against `path` and return its stdout (bytes if `text` is false)."""
+    try:
+        result = subprocess.run(
+            ["git", "-C", path, *args], input=input, check=True, capture_output=True,
+            timeout=GIT_TIMEOUT, env=_git_env(),
+        )
+    except subprocess.CalledProcessError as e:
+        raise GitError(f"git {' '.join(args)} failed: {e.stderr.decode(errors='replace').strip()}") from e
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise GitError(f"git {' '.join(args)} failed: {e}") from e
+    return result.stdout.decode(errors="replace") if text else result.stdout
+
+def mirror_path(repo):
+    return os.path.join(REPO_CACHE_DIR, repo.replace("/", "__") + ".git")
+
+@contextmanager
+def _locked(path):
+    """Serialise updates of one mirror across processes."""
+    os.makedirs(REPO_CACHE_DIR, exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def update(repo):
+    """Bring the local mirror of `repo` up to date and return (path, head_sha).
+
+    The mirror is a bare, blob-less, depth-1 partial clone: fetching only
+    moves commit and tree objects, and file contents are pulled lazily when
+    read. If the remote HEAD hasn't moved, nothing is fetched at all.
+    """
+    path = mirror_path(repo)
+    url = REPO_CLONE_URL.format(repo=repo)
+    with _locked(path):
+        if not os.path.isdir(path):
+            logger.info(f"Creating mirror of {repo} in {path}")
+            git(REPO_CACHE_DIR, "init", "--quiet", "--bare", path)
+            git(path, "remote", "add", "origin", url)
+
+        try:
+            local = git(path, "rev-parse", "--verify", "--quiet", HEAD_REF).strip()
+        except GitError:
+            local = None
+        remote = git(path, "ls-remote", "origin", "HEAD").split()
+        if local and remote and remote[0] == local:
+            return path, local
+
+        logger.info(f"Fetching {repo} HEAD into mirror...")
+        git(path, "fetch", "--quiet", "--depth=1", "--filter=blob:none", "--no-tags", "origin", f"+HEAD:{HEAD_REF}")
+        return path, git(path, "rev-parse", HEAD_REF).strip()
+
+def list_tree(path, sha):
+    """Return every path in the commit, directories included, as (path, type, object id) triples."""
+    entries = []
+    for entry in git(path, "ls-tree", "-r", "-t", "-z", sha).split("\0"):
+        if entry:
+            meta, name = entry.split("\t", 1)  # "<mode> <type> <object>\t<path>"
+            _, kind, oid = meta.split()
+            entries.append((name, kind, oid))
+    return entries
+
+def read_blobs(path, oids):
+    """Return {oid: text} for many blobs at once.
+
+    Blobs missing from the partial clone are fetched in a single request
+    first, instead of one lazy fetch per file.
+    """
+    oids = list(dict.fromkeys(oids))
+    if not oids:
+        return {}
+    present = set(git(path, "cat-file", "--batch-all-objects", "--batch-check=%(objectname)").split())
+    missing = [oid for oid in oids if oid not in present]
+    if missing:
+        git(path, "-c", "fetch.negotiationAlgorithm=noop", "fetch", "--quiet", "--no-tags",
+            "--no-write-fetch-head", "--filter=blob:none", "--stdin", "origin",
+            input="\n".join(missing).encode())
+
+    out = git(path, "cat-file", "--batch", input="\n".join(oids).encode(), text=False)
+    blobs, pos = {}, 0
+    while pos < len(out):
+        header_end = out.index(b"\n", pos)
+        header = out[pos:header_end].decode().split()
+        pos = header_end + 1
+        if len(header) < 3:  # "<oid> missing"
+            continue
+        size = int(header[2])
+        blobs[header[0]] = out[pos:pos + size].decode(errors="replace")
+        pos += size + 1
+    return blobs
+
+def read_file(path, sha, name, limit=None):
+    """Return a file's contents at `sha`, or None if it doesn't exist."""
+    try:
+        text = git(path, "show", f"{sha}:{name}")
+    except GitError:
+        return None
+    return text[:limit] if limit else text
+
+def cached(path, sha, name, build):
+    """Return the JSON artifact `name` built for `sha`, running build() only when the commit changed."""
+    cache_file = os.path.join(path, "octo-jules", f"{name}.json")
+    try:
+        with open(cache_file) as f:
+            stored = json.load(f)
+        if stored.get("sha") == sha:
+            return stored["data"]
+    except (OSError, ValueError):
+        pass
+
+    data = build()
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"sha": sha, "data": data}, f)
+    os.replace(tmp_file, cache_file)
+    return data
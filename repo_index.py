@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import logging
+import posixpath
+import tomllib
+from collections import Counter
+from dotenv import load_dotenv
+import repo_cache
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Characters the prompt-ready summary may use
+REPO_SUMMARY_BUDGET = int(os.getenv("REPO_SUMMARY_BUDGET", "6000"))
+# Source files read for top-level symbols, shallowest first
+REPO_INDEX_MAX_FILES = int(os.getenv("REPO_INDEX_MAX_FILES", "200"))
+MAX_SYMBOLS_PER_FILE = 25
+# Part of the cache key; bump when the index layout changes so cached indexes are rebuilt
+INDEX_VERSION = 1
+
+LANGUAGES = {
+    ".py": "Python", ".js": "JavaScript", ".jsx": "JavaScript", ".mjs": "JavaScript", ".cjs": "JavaScript",
+    ".ts": "TypeScript", ".tsx": "TypeScript", ".go": "Go", ".rs": "Rust", ".java": "Java",
+    ".kt": "Kotlin", ".rb": "Ruby", ".php": "PHP", ".cs": "C#", ".swift": "Swift",
+    ".c": "C", ".h": "C", ".cc": "C++", ".cpp": "C++", ".hpp": "C++", ".sh": "Shell",
+    ".sql": "SQL", ".html": "HTML", ".css": "CSS", ".scss": "CSS", ".vue": "Vue", ".md": "Markdown",
+}
+SKIP_DIRS = {"node_modules", "vendor", "third_party", "dist", "build", "target", "__pycache__", "venv", ".venv"}
+MANIFESTS = ("package.json", "requirements.txt", "pyproject.toml", "Cargo.toml", "go.mod", "Gemfile")
+
+# Top-level definitions per language; group 1 is the symbol name
+SYMBOL_PATTERNS = {
+    "Python": re.compile(r"^(?:async\s+def|def|class)\s+(\w+)", re.M),
+    "JavaScript": re.compile(r"^(?:export\s+(?:default\s+)?)?(?:async\s+)?(?:function\*?|class|const|let)\s+(\w+)", re.M),
+    "TypeScript": re.compile(
+        r"^(?:export\s+(?:default\s+)?)?(?:declare\s+)?(?:abstract\s+)?(?:async\s+)?"
+        r"(?:function\*?|class|const|let|interface|type|enum)\s+(\w+)", re.M),
+    "Go": re.compile(r"^(?:func(?:\s+\([^)]*\))?|type)\s+(\w+)", re.M),
+    "Rust": re.compile(r"^pub(?:\([^)]*\))?\s+(?:async\s+)?(?:fn|struct|enum|trait|mod|type)\s+(\w+)", re.M),
+    "Java": re.compile(r"^(?:public\s+)?(?:abstract\s+|final\s+)*(?:class|interface|enum|record)\s+(\w+)", re.M),
+    "Kotlin": re.compile(r"^(?:\w+\s+)*(?:class|interface|object|fun)\s+(\w+)", re.M),
+    "Ruby": re.compile(r"^(?:class|module|def)\s+([\w:.]+)", re.M),
+    "PHP": re.compile(r"^(?:abstract\s+|final\s+)?(?:class|interface|trait|function)\s+(\w+)", re.M),
+    "C#": re.compile(r"^\s{0,4}(?:public\s+)?(?:static\s+|sealed\s+|abstract\s+|partial\s+)*(?:class|interface|enum|record|struct)\s+(\w+)", re.M),
+}
+
+def language_of(name):
+    return LANGUAGES.get(posixpath.splitext(name)[1].lower())
+
+def is_skipped(name):
+    return any(part.startswith(".") or part in SKIP_DIRS for part in name.split("/"))
+
+def parse_manifest(name, text):
+    """Pull the name, description and dependency names out of a manifest."""
+    info = {}
+    try:
+        if name == "package.json":
+            data = json.loads(text)
+            info = {
+                "name": data.get("name"),
+                "description": data.get("description"),
+                "dependencies": sorted(data.get("dependencies", {})),
+                "dev_dependencies": sorted(data.get("devDependencies", {})),
+                "scripts": sorted(data.get("scripts", {})),
+            }
+        elif name == "pyproject.toml":
+            data = tomllib.loads(text)
+            project = data.get("project", {})
+            poetry = data.get("tool", {}).get("poetry", {})
+            deps = project.get("dependencies") or sorted(poetry.get("dependencies", {}))
+            info = {
+                "name": project.get("name") or poetry.get("name"),
+                "description": project.get("description") or poetry.get("description"),
+                "dependencies": [re.split(r"[\s<>=!~;\[]", d, 1)[0] for d in deps],
+            }
+        elif name == "Cargo.toml":
+            data = tomllib.loads(text)
+            info = {
+                "name": data.get("package", {}).get("name"),
+                "description": data.get("package", {}).get("description"),
+                "dependencies": sorted(data.get("dependencies", {})),
+            }
+        elif name == "requirements.txt":
+            info = {"dependencies": [
+                re.split(r"[\s<>=!~;\[]", line.strip(), 1)[0]
+                for line in text.splitlines() if line.strip() and not line.lstrip().startswith(("#", "-"))
+            ]}
+        elif name == "go.mod":
+            module = re.search(r"^module\s+(\S+)", text, re.M)
+            info = {
+                "name": module.group(1) if module else None,
+                "dependencies": re.findall(r"^\s*([\w.\-/]+\.[\w.\-/]+)\s+v[\w.\-+]+", text, re.M),
+            }
+        elif name == "Gemfile":
+            info = {"dependencies": re.findall(r"""^\s*gem\s+['"]([^'"]+)""", text, re.M)}
+    except (ValueError, tomllib.TOMLDecodeError) as e:
+        logger.warning(f"Could not parse {name}: {e}")
+    return {key: value for key, value in info.items() if value}
+
+def build_index(path, sha):
+    """Index one commit of a mirror: file tree by language, top-level symbols and manifests."""
+    logger.info(f"Building repository index at {sha[:12]}...")
+    blobs = [(name, oid) for name, kind, oid in repo_cache.list_tree(path, sha)
+             if kind == "blob" and not is_skipped(name)]
+
+    languages = Counter()
+    tree = {}
+    for name, _ in blobs:
+        language = language_of(name) or "Other"
+        languages[language] += 1
+        # Bucket files under their top two directory levels
+        directory = "/".join(name.split("/")[:-1][:2]) or "."
+        tree.setdefault(directory, Counter())[language] += 1
+
+    sources = [(name, oid) for name, oid in blobs if language_of(name) in SYMBOL_PATTERNS]
+    sources.sort(key=lambda item: (item[0].count("/"), item[0]))
+    sources = sources[:REPO_INDEX_MAX_FILES]
+    manifests = [(name, oid) for name, oid in blobs if name in MANIFESTS]
+    contents = repo_cache.read_blobs(path, [oid for _, oid in sources + manifests])
+
+    modules = {}
+    for name, oid in sources:
+        symbols = SYMBOL_PATTERNS[language_of(name)].findall(contents.get(oid, ""))
+        modules[name] = list(dict.fromkeys(symbols))[:MAX_SYMBOLS_PER_FILE]
+
+    return {
+        "files": len(blobs),
+        "languages": dict(languages.most_common()),
+        "tree": {directory: dict(counts.most_common()) for directory, counts in sorted(tree.items())},
+        "modules": modules,
+        "manifests": {name: parse_manifest(name, contents.get(oid, "")) for name, oid in manifests},
+    }
+
+def get_index(repo):
+    """Return (path, sha, index) for the repo's current HEAD, building the index at most once per commit."""
+    path, sha = repo_cache.update(repo)
+    index = repo_cache.cached(path, sha, f"index-v{INDEX_VERSION}", lambda: build_index(path, sha))
+    return path, sha, index
+
+def summarize(index, budget=REPO_SUMMARY_BUDGET):
+    """Render the index as prompt-ready text of at most `budget` characters.
+
+    Sections are filled in priority order (languages, manifests, layout,
+    symbols); one that doesn't fit ends with an "... N more" marker.
+    """
+    lines = []
+    remaining = budget
+
+    def add_section(title, entries):
+        nonlocal remaining
+        if not entries or len(title) + len(entries[0]) + 2 > remaining:
+            return
+        section, size = [title], len(title) + 1
+        for i, entry in enumerate(entries):
+            marker = f"  ... {len(entries) - i} more"
+            # Always keep room for the marker unless this is the last entry
+            reserve = 0 if i == len(entries) - 1 else len(marker) + 1
+            if size + len(entry) + 1 + reserve > remaining:
+                if size + len(marker) + 1 <= remaining:
+                    section.append(marker)
+                    size += len(marker) + 1
+                break
+            section.append(entry)
+            size += len(entry) + 1
+        if len(section) > 1:
+            lines.extend(section)
+            remaining -= size
+
+    languages = ", ".join(f"{lang} ({count})" for lang, count in index["languages"].items())
+    header = f"{index['files']} files: {languages}"[:budget - 1]
+    lines.append(header)
+    remaining -= len(header) + 1
+
+    manifest_lines = []
+    for name, info in index["manifests"].items():
+        details = " - ".join(info[key] for key in ("name", "description") if info.get(key))
+        manifest_lines.append(f"- {name}: {details}" if details else f"- {name}")
+        if info.get("dependencies"):
+            manifest_lines.append(f"  dependencies: {', '.join(info['dependencies'])}")
+        if info.get("scripts"):
+            manifest_lines.append(f"  scripts: {', '.join(info['scripts'])}")
+    add_section("Manifests:", manifest_lines)
+
+    add_section("Layout:", [
+        f"- {directory}/ ({', '.join(f'{lang} {count}' for lang, count in counts.items())})"
+        for directory, counts in index["tree"].items()
+    ])
+
+    add_section("Modules:", [
+        f"- {name}: {', '.join(symbols)}" if symbols else f"- {name}"
+        for name, symbols in index["modules"].items()
+    ])
+    return "\n".join(lines)
@@ -0,0 +1,147 @@
+import os
+import re
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+import db
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# How long the index is trusted before new Jules sessions are listed again
+JULES_SESSIONS_TTL = float(os.getenv("JULES_SESSIONS_TTL", "300"))
+TERMINAL_STATES = ("COMPLETED", "FAILED")
+
+def session_id_of(session):
+    return session.get('id') or session.get('name', '').split('/')[-1]
+
+def issue_number_of(title):
+    """Extract the issue number from a session title such as "Fix Issue #12"."""
+    match = re.search(r"#(\d+)\b", title or "")
+    return int(match.group(1)) if match else None
+
+class JulesSessionIndex:
+    """Local index of every Jules session, keyed by (source, title) and (source, issue number).
+
+    The first refresh follows pageToken through the whole listing; later
+    refreshes (at most once per `ttl`) stop at the first page with nothing
+    new or changed, since the listing is newest first, but not before
+    reaching the oldest session still active in the index, whose state may
+    have moved on since it was last listed. Sessions this process creates
+    or polls are written through, so lookups never need a listing call.
+    Rows persist in the jules_sessions table across restarts.
+    """
+
+    def __init__(self, fetch_page, ttl=JULES_SESSIONS_TTL):
+        self._fetch_page = fetch_page  # fetch_page(page_token) -> Jules list response
+        self.ttl = ttl
+        self._sessions = {}
+        self._by_title = {}
+        self._by_issue = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._refreshed_at = None
+
+    def find(self, source, title=None, issue_number=None, active_only=True):
+        """Return the id of the newest matching session, or None."""
+        self.refresh()
+        with self._lock:
+            if title is not None:
+                ids = self._by_title.get((source, title), ())
+            else:
+                ids = self._by_issue.get((source, issue_number), ())
+            candidates = [self._sessions[sid] for sid in ids]
+        if active_only:
+            candidates = [s for s in candidates if s['state'] not in TERMINAL_STATES]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda s: s['create_time'] or '')['id']
+
+    def add(self, session):
+        """Record a session returned by the Jules API."""
+        with self._lock:
+            self._ensure_loaded()
+            row = self._row(session)
+            if self._sessions.get(row['id']) != row:
+                self._store([row])
+
+    def update_state(self, session_id, state):
+        with self._lock:
+            self._ensure_loaded()
+            row = self._sessions.get(session_id)
+            if row and row['state'] != state:
+                self._store([dict(row, state=state)])
+
+    def refresh(self, force=False):
+        """List sessions from Jules if the index is older than the TTL."""
+        with self._lock:
+            self._ensure_loaded()
+            now = time.monotonic()
+            if not force and self._refreshed_at is not None and now - self._refreshed_at < self.ttl:
+                return
+            full = db.get_setting('jules_sessions_synced') != 'true'
+            # Active sessions may have finished since; the listing must reach back past the oldest one
+            oldest_active = min(
+                (row['create_time'] for row in self._sessions.values()
+                 if row['state'] not in TERMINAL_STATES and row['create_time']),
+                default=None,
+            )
+            token, pages, fetched = None, 0, 0
+            try:
+                while True:
+                    data = self._fetch_page(token)
+                    pages += 1
+                    rows = [self._row(s) for s in data.get('sessions', [])]
+                    fetched += len(rows)
+                    changed = [row for row in rows if self._sessions.get(row['id']) != row]
+                    self._store(changed)
+                    token = data.get('nextPageToken')
+                    page_oldest = min((row['create_time'] for row in rows if row['create_time']), default=None)
+                    caught_up = oldest_active is None or (page_oldest is not None and page_oldest <= oldest_active)
+                    if not token or (not full and not changed and caught_up):
+                        break
+            except Exception as e:
+                logger.error(f"Failed to refresh Jules session index: {e}")
+                return
+            if full:
+                db.set_setting('jules_sessions_synced', 'true')
+            self._refreshed_at = now
+            logger.info(f"Jules session index refreshed: {fetched} sessions in {pages} page(s), {len(self._sessions)} indexed")
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        for session_id, source, title, issue_number, state, create_time in db.get_jules_sessions():
+            self._remember({
+                'id': session_id, 'source': source, 'title': title,
+                'issue_number': issue_number, 'state': state, 'create_time': create_time,
+            })
+        self._loaded = True
+
+    def _store(self, rows):
+        if not rows:
+            return
+        db.upsert_jules_sessions([
+            (r['id'], r['source'], r['title'], r['issue_number'], r['state'], r['create_time']) for r in rows
+        ])
+        for row in rows:
+            self._remember(row)
+
+    def _remember(self, row):
+        self._sessions[row['id']] = row
+        self._by_title.setdefault((row['source'], row['title']), set()).add(row['id'])
+        if row['issue_number'] is not None:
+            self._by_issue.setdefault((row['source'], row['issue_number']), set()).add(row['id'])
+
+    @staticmethod
+    def _row(session):
+        title = session.get('title')
+        return {
+            'id': session_id_of(session),
+            'source': session.get('sourceContext', {}).get('source'),
+            'title': title,
+            'issue_number': issue_number_of(title),
+            'state': session.get('state'),
+            'create_time': session.get('createTime'),
+        }
@@ -1,27 +1,33 @@
 import os
+import sys
+import asyncio
 import logging
 import json
-import subprocess
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters
 from telegram.error import BadRequest
 import db
+from config import TARGET_REPOS
+import bot_data
+from job_runner import JobRunner
+from github_client import get_client as get_github
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-if os.getenv("GITHUB_TOKEN") and not os.getenv("GH_TOKEN"):
-    os.environ["GH_TOKEN"] = os.getenv("GITHUB_TOKEN")
-
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-TARGET_REPO = os.getenv("TARGET_REPO")
 ISSUE_LABEL = os.getenv("ISSUE_LABEL", "jules-task")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JOB_ICONS = {"queued": "⏳", "running": "⚙️", "succeeded": "✅", "failed": "❌", "cancelled": "🛑"}
+
+# Long-running actions (backlog generation) run here instead of on the event loop
+jobs = JobRunner()
 
-def get_main_keyboard():
-    paused = db.is_paused()
+def get_main_keyboard(paused):
+    """Build the control panel; `paused` comes from bot_data so rendering never touches the DB."""
     pause_label = "▶️ Resume" if paused else "⏸ Pause"
     pause_callback = "resume" if paused else "pause"
     
@@ -42,7 +48,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "🐙 *Octo-Jules Control Center*\n\nManage your autonomous coding agent from here.",
         parse_mode="Markdown",
-        reply_markup=get_main_keyboard()
+        reply_markup=get_main_keyboard(await bot_data.is_paused())
     )
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -53,15 +59,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         if data == "status":
-            conn = db.get_connection()
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute("SELECT issue_title, state FROM sessions ORDER BY created_at DESC LIMIT 5")
-                    rows = cursor.fetchall()
-            finally:
-                conn.close()
-            
-            paused = db.is_paused()
+            rows = await bot_data.recent_sessions(5)
+            paused = await bot_data.is_paused()
             msg = f"*Current State:* {'⏸ PAUSED' if paused else '🚀 RUNNING'}\n\n*Recent Sessions:*\n"
             if not rows:
                 msg += "No sessions yet."
@@ -69,15 +68,15 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 for row in rows:
                     msg += f"• {row[0]}: `{row[1]}`\n"
             
-            await query.edit_message_text(msg, parse_mode="Markdown", reply_markup=get_main_keyboard())
+            await query.edit_message_text(msg, parse_mode="Markdown", reply_markup=get_main_keyboard(paused))
 
         elif data == "pause":
-            db.set_paused(True)
-            await query.edit_message_text("⏸ Orchestrator has been *PAUSED*.", parse_mode="Markdown", reply_markup=get_main_keyboard())
+            await bot_data.set_paused(True)
+            await query.edit_message_text("⏸ Orchestrator has been *PAUSED*.", parse_mode="Markdown", reply_markup=get_main_keyboard(True))
             
         elif data == "resume":
-            db.set_paused(False)
-            await query.edit_message_text("🚀 Orchestrator has been *RESUMED*.", parse_mode="Markdown", reply_markup=get_main_keyboard())
+            await bot_data.set_paused(False)
+            await query.edit_message_text("🚀 Orchestrator has been *RESUMED*.", parse_mode="Markdown", reply_markup=get_main_keyboard(False))
     except BadRequest:
         # Ignore "Message is not modified" errors
         pass
@@ -107,24 +106,21 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     elif data.startswith("run_sync:"):
         persona_key = data.split(":")[1]
-        cmd = ["python3", "backlog_sustainer.py", "--force"]
+        # Unbuffered so progress lines arrive as they are printed
+        cmd = [sys.executable, "-u", os.path.join(BASE_DIR, "backlog_sustainer.py"), "--force"]
         
         target_name = "Random Agent"
         if persona_key != "random":
             cmd.extend(["--persona", persona_key])
             target_name = persona_key
-            
+
         await query.edit_message_text(f"🧠 {target_name} is brainstorming new tasks...")
-        
-        try:
-            # Using list format for secure argument passing
-            subprocess.run(cmd, check=True)
-            await query.message.reply_text(f"✅ Ideas generated by {target_name}!")
-        except Exception as e:
-            await query.message.reply_text(f"❌ Generation failed: {e}")
-            
-        # Return to main menu
-        await query.message.reply_text("Control Center:", reply_markup=get_main_keyboard())
+        jobs.submit(f"Brainstorm ({target_name})", cmd, on_update=job_progress(query.message), cwd=BASE_DIR)
+
+    elif data.startswith("cancel_job:"):
+        job_id = int(data.split(":")[1])
+        if not await jobs.cancel(job_id):
+            await query.message.reply_text(f"Job {job_id} is not running.")
 
     elif data == "ask_task":
         await query.message.reply_text("Send the task in this format:\n`/add_task Title:Body`", parse_mode="Markdown")
@@ -134,46 +130,131 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("Cleaning up terminal states in database...")
         # Add logic here if needed
 
+def format_job(job):
+    text = f"{JOB_ICONS[job.status]} Job {job.id}: {job.name} — {job.status}"
+    if job.started_at is not None:
+        text += f" ({format_duration(job.elapsed)})"
+    if job.output:
+        text += f"\n\n{job.tail()}"
+    return text
+
+def job_progress(message):
+    """Return an on_update callback that streams a job's progress into `message` by editing it."""
+    async def update(job):
+        markup = None if job.done else InlineKeyboardMarkup(
+            [[InlineKeyboardButton("✖ Cancel", callback_data=f"cancel_job:{job.id}")]]
+        )
+        try:
+            # Plain text: job output may contain stray Markdown characters
+            await message.edit_text(format_job(job)[:4000], reply_markup=markup)
+        except BadRequest:
+            # "Message is not modified" when nothing new was printed
+            pass
+        if job.done:
+            await message.reply_text("Control Center:", reply_markup=get_main_keyboard(await bot_data.is_paused()))
+    return update
+
+async def list_jobs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not jobs.jobs:
+        await update.message.reply_text("No jobs yet.")
+        return
+    lines = []
+    for job in reversed(jobs.jobs.values()):
+        line = f"{JOB_ICONS[job.status]} {job.id}: {job.name} — {job.status}"
+        if job.started_at is not None:
+            line += f" ({format_duration(job.elapsed)})"
+        lines.append(line)
+    if jobs.active():
+        lines.append("\nStop one with /cancel <id>.")
+    await update.message.reply_text("\n".join(lines))
+
+async def cancel_job(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /cancel <job_id> (see /jobs)")
+        return
+    job_id = int(context.args[0])
+    if await jobs.cancel(job_id):
+        await update.message.reply_text(f"🛑 Cancelling job {job_id}...")
+    else:
+        await update.message.reply_text(f"❌ Job {job_id} is not running.")
+
 async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
-        await update.message.reply_text("Usage: /add_task <title>:<body_optional>")
+        await update.message.reply_text("Usage: /add_task [owner/repo] <title>:<body_optional>")
         return
         
-    text = " ".join(context.args)
+    args = list(context.args)
+    repo = args.pop(0) if len(args) > 1 and args[0] in TARGET_REPOS else TARGET_REPOS[0]
+    text = " ".join(args)
     if ":" in text:
         title, body = text.split(":", 1)
     else:
         title, body = text, ""
         
-    cmd = f'gh issue create --repo {TARGET_REPO} --title "{title.strip()}" --body "{body.strip()}" --label "{ISSUE_LABEL}"'
     try:
-        result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
-        await update.message.reply_text(f"✅ Issue created: {result.stdout.strip()}")
+        issue = await asyncio.to_thread(
+            get_github().create_issue, repo, title.strip(), body.strip(), labels=[ISSUE_LABEL]
+        )
+        await update.message.reply_text(f"✅ Issue created: {issue['url']}")
     except Exception as e:
         await update.message.reply_text(f"❌ Failed to create issue: {e}")
 
 async def pick_issue(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
-        await update.message.reply_text("Usage: /pick <issue_number>")
+        await update.message.reply_text("Usage: /pick <issue_number> or /pick owner/repo#<issue_number>")
         return
     
     try:
-        issue_number = int(context.args[0])
-        db.set_setting('next_issue', issue_number)
-        await update.message.reply_text(f"✅ Issue #{issue_number} selected. Jules will start shortly.")
+        repo, _, number = context.args[0].rpartition('#')
+        repo = repo or (context.args[1] if len(context.args) > 1 else TARGET_REPOS[0])
+        if repo not in TARGET_REPOS:
+            await update.message.reply_text(f"❌ {repo} is not a configured repository.")
+            return
+        issue_number = int(number)
+        await db.run_async(db.set_setting, 'next_issue', f"{repo}#{issue_number}")
+        await update.message.reply_text(f"✅ Issue {repo}#{issue_number} selected. Jules will start shortly.")
     except ValueError:
         await update.message.reply_text("❌ Please provide a valid issue number.")
     except Exception as e:
         await update.message.reply_text(f"❌ Error: {e}")
 
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    days = int(context.args[0]) if context.args and context.args[0].isdigit() else 7
+    latencies = await db.run_async(db.get_stage_latencies, days)
+    throughput = await db.run_async(db.get_daily_throughput, days)
+
+    msg = f"*Time in state (last {days}d):*\n"
+    if not latencies:
+        msg += "No finished stages yet.\n"
+    for state, samples, p50, p95 in latencies:
+        msg += f"• `{state}`: p50 {format_duration(p50)}, p95 {format_duration(p95)} ({samples})\n"
+
+    started = sum(row[1] for row in throughput)
+    merged = sum(row[2] for row in throughput)
+    failed = sum(row[3] for row in throughput)
+    msg += f"\n*Throughput:* {started} started, {merged} merged, {failed} failed"
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
 if __name__ == '__main__':
     if not TOKEN:
         print("Error: TELEGRAM_BOT_TOKEN not set.")
     else:
+        bot_data.start()
         app = ApplicationBuilder().token(TOKEN).build()
         app.add_handler(CommandHandler("start", start))
         app.add_handler(CommandHandler("add_task", add_task))
         app.add_handler(CommandHandler("pick", pick_issue))
+        app.add_handler(CommandHandler("stats", stats))
+        app.add_handler(CommandHandler("jobs", list_jobs))
+        app.add_handler(CommandHandler("cancel", cancel_job))
         app.add_handler(CommandHandler("status", lambda u, c: start(u, c))) # Alias /status to /start for keyboard
         app.add_handler(CallbackQueryHandler(button_handler))
         app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), start))
@@ -0,0 +1,102 @@
+import os
+import hmac
+import json
+import hashlib
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# The receiver only starts when a port is configured
+WEBHOOK_PORT = os.getenv("WEBHOOK_PORT")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET")
+HANDLED_EVENTS = {"pull_request", "issues"}
+
+def sign(secret, body):
+    """Return the X-Hub-Signature-256 header value GitHub sends for `body`."""
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+def verify_signature(secret, body, signature):
+    """Check a delivery's X-Hub-Signature-256 header in constant time."""
+    if not signature:
+        return False
+    return hmac.compare_digest(sign(secret, body), signature)
+
+def make_handler(on_event, secret):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def do_POST(self):
+            if self.path != WEBHOOK_PATH:
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not verify_signature(secret, body, self.headers.get("X-Hub-Signature-256")):
+                logger.warning("Rejected webhook delivery with a bad signature.")
+                self.send_response(401)
+                self.end_headers()
+                return
+
+            event = self.headers.get("X-GitHub-Event", "")
+            if event in HANDLED_EVENTS:
+                try:
+                    on_event(event, json.loads(body))
+                except Exception as e:
+                    logger.error(f"Failed to handle {event} webhook: {e}")
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+
+            self.send_response(204)
+            self.end_headers()
+
+    return WebhookHandler
+
+def start(on_event, port=WEBHOOK_PORT, secret=GITHUB_WEBHOOK_SECRET):
+    """Serve GitHub webhooks on a background thread, calling on_event(event, payload).
+
+    Returns the server, or None when the receiver is not configured.
+    """
+    if not port:
+        return None
+    if not secret:
+        logger.error("WEBHOOK_PORT is set but GITHUB_WEBHOOK_SECRET is not. Webhook receiver disabled.")
+        return None
+
+    server = ThreadingHTTPServer(("0.0.0.0", int(port)), make_handler(on_event, secret))
+    threading.Thread(target=server.serve_forever, name="webhooks", daemon=True).start()
+    logger.info(f"Listening for GitHub webhooks on :{port}{WEBHOOK_PATH}")
+    return server
+
+def main():
+    """Replay a recorded webhook payload against a running receiver."""
+    parser = argparse.ArgumentParser(description="Post a recorded GitHub webhook payload, signed with GITHUB_WEBHOOK_SECRET.")
+    parser.add_argument("payload", help="Path to a JSON payload file")
+    parser.add_argument("--event", required=True, choices=sorted(HANDLED_EVENTS))
+    parser.add_argument("--url", default=f"http://localhost:{WEBHOOK_PORT or 8080}{WEBHOOK_PATH}")
+    args = parser.parse_args()
+
+    if not GITHUB_WEBHOOK_SECRET:
+        print("Error: GITHUB_WEBHOOK_SECRET not set.")
+        return
+
+    with open(args.payload, "rb") as f:
+        body = f.read()
+    response = requests.post(args.url, data=body, timeout=10, headers={
+        "Content-Type": "application/json",
+        "X-GitHub-Event": args.event,
+        "X-Hub-Signature-256": sign(GITHUB_WEBHOOK_SECRET, body),
+    })
+    print(f"{response.status_code} {response.reason}")
+
+if __name__ == "__main__":
+    main()